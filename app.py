@@ -1,21 +1,213 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, g
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import json
 import os
 import logging
 from datetime import datetime
-from threading import Lock
+from threading import Lock, Event, Thread, BoundedSemaphore
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+import itertools
+import hashlib
+import hmac
+import math
+import re
+import unicodedata
 import time
 import uuid
+import sqlite3
+import atexit
+import queue
+import fcntl
+import heapq
+import sys
+import zlib
+import gzip
+import socket
+import ipaddress
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import urljoin, urlparse, urldefrag
+from bs4 import BeautifulSoup
+import schedule
 from flask_cors import CORS  # Importamos CORS para habilitar las solicitudes cross-origin
+try:
+    import brotli  # Opcional: añade la variante br a las respuestas precalculadas
+except ImportError:
+    brotli = None
 
-# Configuración de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+def gevent_patched():
+    """Indicar si gevent ha parcheado threading (workers gevent de gunicorn): los hilos pasan a ser greenlets
+    de un único hilo del sistema y cualquier llamada bloqueante detiene todas las peticiones"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+GEVENT_PATCHED = gevent_patched()
+
+def native(module, name):
+    """Objeto original de la biblioteca estándar aunque gevent lo haya sustituido (hilos, bloqueos y colas reales)"""
+    if GEVENT_PATCHED:
+        from gevent import monkey
+        return monkey.get_original(module, name)
+    return getattr(__import__(module), name)
+
+def run_blocking(fn, *args):
+    """Ejecutar una llamada bloqueante sin detener el bucle de eventos: con gevent, en el pool de hilos
+    reales del hub; sin gevent, directamente en el hilo actual"""
+    if GEVENT_PATCHED:
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+# Configuración de logging: los registros se encolan y un hilo de fondo los escribe
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # json | text
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))  # registros en cola antes de descartar
+LOG_SAMPLE_WINDOW = float(os.environ.get("LOG_SAMPLE_WINDOW", 60))  # segundos de cada ventana de muestreo
+LOG_SAMPLE_BURST = int(os.environ.get("LOG_SAMPLE_BURST", 10))  # avisos y errores por punto del código y ventana
+LOG_BODY_CHARS = int(os.environ.get("LOG_BODY_CHARS", 300))  # caracteres máximos de un cuerpo de error registrado
+
+# ID de sesión de la petición en curso, añadido a cada registro
+log_session_id = ContextVar("log_session_id", default=None)
+
+LOG_CONTEXT_FIELDS = ("session_id", "backend", "endpoint", "attempt", "duration_ms", "status", "suppressed")
+
+class JsonLogFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON con los campos de contexto disponibles"""
+    
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in LOG_CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogSampler(logging.Filter):
+    """Limita los avisos y errores repetidos: como máximo `burst` por punto del código en cada ventana.
+    El primer registro de la ventana siguiente indica cuántos se omitieron"""
+    
+    def __init__(self, window, burst):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.suppressed = 0
+        self._windows = {}  # (fichero, línea) -> [inicio de la ventana, emitidos, omitidos]
+        self._lock = Lock()
+    
+    def filter(self, record):
+        if getattr(record, "session_id", None) is None:
+            record.session_id = log_session_id.get()
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                omitted = state[2] if state is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if omitted:
+                    record.suppressed = omitted
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            self.suppressed += 1
+            return False
+
+class DroppingQueueHandler(QueueHandler):
+    """Encola los registros sin bloquear: si la cola tiene max_size registros, el registro se descarta y se cuenta.
+    La cola es una SimpleQueue nativa, segura entre greenlets y el hilo real que escribe"""
+    
+    def __init__(self, max_size):
+        super().__init__(native("queue", "SimpleQueue")())
+        self.max_size = max_size
+        self.dropped = 0
+    
+    def prepare(self, record):
+        # El formateo se hace en el hilo de escritura, no en el de la petición
+        return record
+    
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+class NativeQueueListener(QueueListener):
+    """QueueListener que escribe desde un hilo del sistema también con gevent, donde threading.Thread
+    sería un greenlet del bucle de eventos y una escritura lenta en stdout bloquearía todas las peticiones"""
+    
+    def start(self):
+        if not GEVENT_PATCHED:
+            return super().start()
+        self._finished = native("_thread", "allocate_lock")()
+        self._finished.acquire()
+        native("_thread", "start_new_thread")(self._run_native, ())
+    
+    def _run_native(self):
+        try:
+            self._monitor()
+        finally:
+            self._finished.release()
+    
+    def stop(self):
+        if not GEVENT_PATCHED:
+            return super().stop()
+        self.enqueue_sentinel()
+        self._finished.acquire(timeout=5)
+
+def configure_logging():
+    """Sustituir los handlers del logger raíz por la cola y arrancar el hilo que escribe en la salida estándar"""
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    # El handler de salida solo lo usa el hilo de escritura: su bloqueo también debe ser nativo
+    stream_handler.lock = native("_thread", "RLock")()
+    
+    handler = DroppingQueueHandler(LOG_QUEUE_SIZE)
+    sampler = LogSampler(window=LOG_SAMPLE_WINDOW, burst=LOG_SAMPLE_BURST)
+    handler.addFilter(sampler)
+    
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    
+    listener = NativeQueueListener(handler.queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return handler, sampler
+
+log_handler, log_sampler = configure_logging()
 logger = logging.getLogger(__name__)
 
+def logging_stats():
+    return {
+        "format": LOG_FORMAT,
+        "queued": log_handler.queue.qsize(),
+        "dropped": log_handler.dropped,
+        "suppressed": log_sampler.suppressed
+    }
+
 app = Flask(__name__)
 # Habilitar CORS para todas las rutas y orígenes
 CORS(app, resources={r"/": {"origins": ""}})
@@ -24,6 +216,141 @@ CORS(app, resources={r"/": {"origins": ""}})
 OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://173.249.8.251:11434")
 MODEL_NAME = os.environ.get("MODEL_NAME", "neural-chat:7b")
 
+# Enrutado por nivel de modelo: las consultas cortas van a un modelo rápido y los análisis a MODEL_NAME
+MODEL_FAST_NAME = os.environ.get("MODEL_FAST_NAME", "")  # vacío = todo al modelo principal
+ROUTER_FAST_MAX_CHARS = int(os.environ.get("ROUTER_FAST_MAX_CHARS", 160))
+ROUTER_FAST_MAX_HISTORY_TURNS = int(os.environ.get("ROUTER_FAST_MAX_HISTORY_TURNS", 6))
+ROUTER_DEEP_KEYWORDS = [k.strip() for k in os.environ.get(
+    "ROUTER_DEEP_KEYWORDS",
+    "anali,compar,informe,estrateg,benchmark,precio,competid,recomend,fortalez,debilidad,mercado,tendencia,dafo,swot"
+).split(",") if k.strip()]
+
+# Backends de Ollama: OLLAMA_URL admite varias URLs separadas por comas
+OLLAMA_BACKENDS = [url.strip().rstrip("/") for url in OLLAMA_URL.split(",") if url.strip()]
+OLLAMA_FALLBACK_URL = os.environ.get("OLLAMA_FALLBACK_URL", "http://127.0.0.1:11434").rstrip("/")  # usada tras un 403; vacío la desactiva
+OLLAMA_ROUTING = os.environ.get("OLLAMA_ROUTING", "least_outstanding")  # least_outstanding | latency
+OLLAMA_HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", 15))  # segundos; 0 desactiva las sondas
+
+# Configuración del pool de conexiones hacia Ollama
+OLLAMA_POOL_CONNECTIONS = int(os.environ.get("OLLAMA_POOL_CONNECTIONS", 4))
+OLLAMA_POOL_MAXSIZE = int(os.environ.get("OLLAMA_POOL_MAXSIZE", 16))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", 5))
+MODEL_KEEP_ALIVE = os.environ.get("MODEL_KEEP_ALIVE", "30m")  # tiempo que Ollama mantiene el modelo cargado; vacío = valor del servidor
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", 300))  # segundos máximos para cargar el modelo
+WARMUP_RETRY_INTERVAL = float(os.environ.get("WARMUP_RETRY_INTERVAL", 15))  # segundos entre intentos si la carga falla
+KEEP_ALIVE_PING_INTERVAL = float(os.environ.get("KEEP_ALIVE_PING_INTERVAL", 240))  # segundos entre pings que mantienen el modelo cargado (0 = desactivado)
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", 180))
+
+# Prompt de sistema reducido que se envía cuando el conocimiento se inyecta por recuperación
+CORE_SYSTEM_PROMPT = """
+Eres Curiosity, un agente especializado en investigación de mercado y análisis competitivo para soluciones de IA conversacional. Analizas empresas del sector y las comparas con Antares Innovate (www.antaresinnovate.com) para identificar oportunidades de mejora, elementos a implementar y estrategias para destacar en el mercado, con foco en Estados Unidos y Colombia.
+
+Cuando analices un competidor o una tendencia, proporciona un análisis objetivo de sus fortalezas y debilidades, una comparación directa con Antares Innovate, recomendaciones específicas y accionables, y la evaluación de la oportunidad o amenaza que representa.
+"""
+
+# Almacenamiento de sesiones: "memory" (por worker) o "sqlite" (compartido entre workers y persistente)
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", 0.05))  # segundos entre escrituras agrupadas
+
+# Límites del almacenamiento de sesiones
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", 1000))
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", 3600))  # segundos
+SESSION_MAX_MESSAGES = int(os.environ.get("SESSION_MAX_MESSAGES", 100))
+SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", 50 * 1024 * 1024))
+SESSION_COMPRESS_COLD = os.environ.get("SESSION_COMPRESS_COLD", "true").lower() == "true"  # comprimir turnos fuera de la ventana activa
+SESSION_COMPRESS_MIN_BYTES = int(os.environ.get("SESSION_COMPRESS_MIN_BYTES", 512))  # mensajes más pequeños no compensa comprimirlos
+
+# Presupuesto de contexto del historial enviado al modelo
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", 2048))
+CONTEXT_KEEP_TURNS = int(os.environ.get("CONTEXT_KEEP_TURNS", 6))
+CONTEXT_SUMMARY_ENABLED = os.environ.get("CONTEXT_SUMMARY_ENABLED", "true").lower() == "true"
+
+# Caché de respuestas
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 512))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 6 * 3600))  # segundos
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR", "")  # vacío = sin caché en disco
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", 0))  # 0 = solo coincidencia exacta
+RESPONSE_CACHE_HISTORY_AWARE = os.environ.get("RESPONSE_CACHE_HISTORY_AWARE", "true").lower() == "true"
+
+# Agrupación de generaciones idénticas en curso
+COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "true").lower() == "true"
+COALESCE_TIMEOUT = float(os.environ.get("COALESCE_TIMEOUT", 600))  # segundos que espera una petición agrupada
+
+# Control de admisión de generaciones hacia Ollama
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", 4))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 32))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 30))  # segundos máximos en cola
+ADMISSION_MAX_PER_SESSION = int(os.environ.get("ADMISSION_MAX_PER_SESSION", 2))  # generaciones en curso o en cola por sesión
+
+# Lotes de mensajes en /chat/batch
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 100))
+BATCH_MAX_PARALLELISM = int(os.environ.get("BATCH_MAX_PARALLELISM", 4))
+
+# Plazo total de una petición (reintentos y alternativas incluidos) y envío en paralelo de la alternativa
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 120))  # segundos por defecto
+REQUEST_DEADLINE_MAX = float(os.environ.get("REQUEST_DEADLINE_MAX", 600))  # máximo que puede pedir un cliente
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_DELAY = float(os.environ.get("HEDGE_DELAY", 15))  # segundos sin respuesta antes de lanzar la alternativa
+
+# Motor de informes
+REPORTS_DIR = os.environ.get("REPORTS_DIR", "reports")
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", 1))  # informes generados a la vez
+REPORT_SECTION_PARALLELISM = int(os.environ.get("REPORT_SECTION_PARALLELISM", 3))  # secciones generadas a la vez
+REPORT_COMPETITOR_CHARS = int(os.environ.get("REPORT_COMPETITOR_CHARS", 6000))  # caracteres de análisis de competidores por sección
+
+# Rastreo de webs de competidores
+CRAWL_CACHE_DIR = os.environ.get("CRAWL_CACHE_DIR", "crawl_cache")
+CRAWL_MAX_PAGES = int(os.environ.get("CRAWL_MAX_PAGES", 5))  # páginas por competidor (la URL y sus enlaces internos)
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", 8))
+CRAWL_PER_HOST = int(os.environ.get("CRAWL_PER_HOST", 2))  # descargas simultáneas por host
+CRAWL_HOST_DELAY = float(os.environ.get("CRAWL_HOST_DELAY", 0.5))  # segundos entre peticiones al mismo host
+CRAWL_TIMEOUT = float(os.environ.get("CRAWL_TIMEOUT", 15))
+CRAWL_MAX_BYTES = int(os.environ.get("CRAWL_MAX_BYTES", 2 * 1024 * 1024))
+CRAWL_ANALYSIS_CHARS = int(os.environ.get("CRAWL_ANALYSIS_CHARS", 8000))  # texto máximo enviado al modelo
+CRAWL_USER_AGENT = os.environ.get("CRAWL_USER_AGENT", "CuriosityBot/1.0 (+https://www.antaresinnovate.com)")
+CRAWL_MAX_REDIRECTS = int(os.environ.get("CRAWL_MAX_REDIRECTS", 5))
+# Hosts que se pueden rastrear aunque resuelvan a direcciones privadas (solo para pruebas, p. ej. "127.0.0.1,localhost")
+CRAWL_ALLOWED_HOSTS = {h.strip().lower() for h in os.environ.get("CRAWL_ALLOWED_HOSTS", "").split(",") if h.strip()}
+
+# Competidores que se actualizan periódicamente (URLs separadas por comas)
+COMPETITORS_URLS = [url.strip() for url in os.environ.get(
+    "COMPETITORS_URLS",
+    "https://www.aivo.co,https://botmaker.com,https://www.ibm.com/products/watsonx-assistant,https://botpress.com"
+).split(",") if url.strip()]
+
+# Tareas programadas (solo se ejecutan en un worker)
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "true").lower() == "true"
+COMPETITOR_REFRESH_HOURS = float(os.environ.get("COMPETITOR_REFRESH_HOURS", 6))
+REPORT_SCHEDULE_TIMES = [t.strip() for t in os.environ.get("REPORT_SCHEDULE_TIMES", "07:00,16:00").split(",") if t.strip()]
+
+# Recuperación local de conocimiento para reducir el tamaño de los prompts
+RETRIEVAL_ENABLED = os.environ.get("RETRIEVAL_ENABLED", "true").lower() == "true"
+RETRIEVAL_INDEX_PATH = os.environ.get("RETRIEVAL_INDEX_PATH", "retrieval_index.json")
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", 4))
+RETRIEVAL_CHUNK_CHARS = int(os.environ.get("RETRIEVAL_CHUNK_CHARS", 800))
+
+# Métricas en formato Prometheus (límites de los histogramas)
+METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+METRICS_THROUGHPUT_BUCKETS = (1, 2.5, 5, 10, 20, 40, 80, 160)
+
+# Respuestas precalculadas (ETag y compresión) de las rutas de consulta
+HTTP_CACHE_TTL = float(os.environ.get("HTTP_CACHE_TTL", 5))  # segundos que se reutiliza una respuesta dinámica
+HTTP_CACHE_MAX_ENTRIES = int(os.environ.get("HTTP_CACHE_MAX_ENTRIES", 256))
+HTTP_COMPRESS_MIN_BYTES = int(os.environ.get("HTTP_COMPRESS_MIN_BYTES", 1024))  # tamaño mínimo para comprimir
+HTTP_GZIP_LEVEL = int(os.environ.get("HTTP_GZIP_LEVEL", 6))
+
+# Token de las rutas de administración (exportar e importar sesiones); vacío = rutas desactivadas
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Respuestas de error devueltas al usuario cuando Ollama falla (nunca se guardan en caché)
+MSG_UNEXPECTED_FORMAT = "Lo siento, no pude generar una respuesta apropiada en este momento."
+MSG_COMMUNICATION_ERROR = "Lo siento, estoy experimentando problemas técnicos de comunicación. ¿Podríamos intentarlo más tarde?"
+MSG_CONNECTION_FAILED = "No se pudo conectar al servicio. Por favor, inténtelo de nuevo más tarde."
+ERROR_RESPONSES = {MSG_UNEXPECTED_FORMAT, MSG_COMMUNICATION_ERROR, MSG_CONNECTION_FAILED}
+
 # Contexto del sistema para Curiosity - Actualizado para enfocarse en investigación y comparación
 ASSISTANT_CONTEXT = """
 # Curiosity: Agente de Investigación y Análisis Competitivo en IA Conversacional
@@ -78,154 +405,3278 @@ Cuando te soliciten analizar un competidor o tendencia específica, proporciona:
 - Recomendaciones específicas sobre qué adoptar, mejorar o diferenciar
 - Evaluación de la oportunidad/amenaza que representa
 
-Recuerda que tu objetivo es ayudar a Antares Innovate a crear una estrategia competitiva superior, identificando lo mejor del mercado para implementarlo o mejorarlo, mientras se desarrollan diferenciadores únicos.
-"""
+Recuerda que tu objetivo es ayudar a Antares Innovate a crear una estrategia competitiva superior, identificando lo mejor del mercado para implementarlo o mejorarlo, mientras se desarrollan diferenciadores únicos.
+"""
+
+class Message:
+    """Mensaje del historial en memoria: rol internado y contenido que se comprime con zlib
+    cuando el turno queda fuera de la ventana activa. Se descomprime solo al leerlo"""
+    
+    __slots__ = ("role", "_content", "_compressed", "size")
+    
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self._content = content
+        self._compressed = None
+        self.size = len(content.encode("utf-8"))  # bytes sin comprimir
+    
+    @property
+    def content(self):
+        if self._content is not None:
+            return self._content
+        return zlib.decompress(self._compressed).decode("utf-8")
+    
+    @property
+    def compressed(self):
+        return self._compressed is not None
+    
+    @property
+    def stored_bytes(self):
+        return len(self._compressed) if self._compressed is not None else self.size
+    
+    def compress(self, min_bytes):
+        """Comprimir el contenido si es suficientemente grande y la compresión compensa. Devuelve los bytes ahorrados"""
+        if self._content is None or self.size < min_bytes:
+            return 0
+        compressed = zlib.compress(self._content.encode("utf-8"))
+        if len(compressed) >= self.size:
+            return 0
+        self._compressed = compressed
+        self._content = None
+        return self.size - len(compressed)
+    
+    def __getitem__(self, key):
+        # Acceso como diccionario para los constructores de prompts (m["role"], m["content"])
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+    
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+class MemorySessionStore:
+    """Almacenamiento de sesiones en memoria con expulsión LRU, expiración por inactividad y límites de memoria.
+    Los turnos fuera de la ventana activa se guardan comprimidos"""
+    
+    def __init__(self, max_sessions, idle_ttl, max_messages, max_bytes, hot_messages=12, compress_min_bytes=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.hot_messages = hot_messages  # mensajes recientes que se mantienen sin comprimir
+        self.compress_min_bytes = compress_min_bytes  # None desactiva la compresión
+        self._sessions = OrderedDict()  # session_id -> entrada de la sesión, del menos al más reciente
+        self._total_bytes = 0  # bytes ocupados (comprimidos en los turnos fríos)
+        self._total_raw_bytes = 0  # bytes sin comprimir, para medir el ahorro
+        self._generations = itertools.count(1)
+        self._lock = Lock()
+        self._counters = {
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+            "evicted_bytes": 0,
+            "trimmed_messages": 0,
+            "compressed_messages": 0
+        }
+    
+    def _account(self, entry, stored, raw):
+        """Sumar (o restar, con valores negativos) bytes a la sesión y al total"""
+        entry["bytes"] += stored
+        entry["raw_bytes"] += raw
+        self._total_bytes += stored
+        self._total_raw_bytes += raw
+    
+    def _compress_cold(self, entry, added):
+        """Comprimir los mensajes que acaban de salir de la ventana activa (con el lock adquirido)"""
+        if self.compress_min_bytes is None:
+            return
+        messages = entry["messages"]
+        boundary = len(messages) - self.hot_messages
+        for message in messages[max(0, boundary - added):max(0, boundary)]:
+            saved = message.compress(self.compress_min_bytes)
+            if saved:
+                self._account(entry, -saved, 0)
+                self._counters["compressed_messages"] += 1
+    
+    def _touch(self, session_id, create=False):
+        """Marcar la sesión como usada recientemente (debe llamarse con el lock adquirido)"""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            if not create:
+                return None
+            entry = {
+                "messages": [],  # registros Message
+                "bytes": 0,
+                "raw_bytes": 0,
+                "last_access": 0,
+                "base": 0,  # índice absoluto del primer mensaje conservado
+                "summary": "",  # resumen de los mensajes anteriores a summary_upto
+                "summary_upto": 0,
+                "generation": next(self._generations)  # cambia al reiniciar la sesión
+            }
+            self._sessions[session_id] = entry
+        else:
+            self._sessions.move_to_end(session_id)
+        entry["last_access"] = time.monotonic()
+        entry["last_seen"] = time.time()  # hora real del último acceso, para exportar
+        return entry
+    
+    def _remove(self, session_id, reason):
+        entry = self._sessions.pop(session_id)
+        self._total_bytes -= entry["bytes"]
+        self._total_raw_bytes -= entry["raw_bytes"]
+        self._counters[reason] += 1
+    
+    def _evict(self, keep=None):
+        """Expulsar sesiones expiradas y, si se superan los límites, las menos usadas (con el lock adquirido)"""
+        # Las sesiones están ordenadas por último acceso, así que las expiradas están al principio
+        if self.idle_ttl > 0:
+            deadline = time.monotonic() - self.idle_ttl
+            while self._sessions:
+                session_id, entry = next(iter(self._sessions.items()))
+                if entry["last_access"] > deadline or session_id == keep:
+                    break
+                self._remove(session_id, "evicted_ttl")
+        
+        while len(self._sessions) > self.max_sessions:
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break
+            self._remove(session_id, "evicted_lru")
+        
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break
+            self._remove(session_id, "evicted_bytes")
+    
+    def ensure(self, session_id):
+        """Crear la sesión si no existe. Devuelve True si se ha creado"""
+        with self._lock:
+            created = session_id not in self._sessions
+            self._touch(session_id, create=True)
+            self._evict(keep=session_id)
+            return created
+    
+    def get_messages(self, session_id):
+        """Obtener una copia del historial de la sesión (vacío si no existe)"""
+        with self._lock:
+            entry = self._touch(session_id)
+            messages = list(entry["messages"]) if entry else []
+        return [message.to_dict() for message in messages]
+    
+    def get_context(self, session_id):
+        """Obtener el historial pendiente de resumir junto con el resumen acumulado de la sesión"""
+        with self._lock:
+            entry = self._touch(session_id)
+            if entry is None:
+                return {"messages": [], "start": 0, "summary": "", "generation": None}
+            start = max(entry["summary_upto"], entry["base"])
+            return {
+                "messages": entry["messages"][start - entry["base"]:],
+                "start": start,  # índice absoluto del primer mensaje devuelto
+                "summary": entry["summary"],
+                "generation": entry["generation"]
+            }
+    
+    def set_summary(self, session_id, generation, summary, upto):
+        """Guardar el resumen de los mensajes anteriores al índice absoluto `upto`.
+        Se ignora si la sesión se reinició o expiró mientras se generaba"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry["generation"] != generation or upto <= entry["summary_upto"]:
+                return False
+            size_delta = len(summary.encode("utf-8")) - len(entry["summary"].encode("utf-8"))
+            entry["summary"] = summary
+            entry["summary_upto"] = upto
+            self._account(entry, size_delta, size_delta)
+            return True
+    
+    def append(self, session_id, *messages):
+        """Añadir mensajes al historial respetando el máximo de mensajes por sesión"""
+        with self._lock:
+            entry = self._touch(session_id, create=True)
+            for message in messages:
+                record = Message(message["role"], message["content"])
+                entry["messages"].append(record)
+                self._account(entry, record.size, record.size)
+            self._compress_cold(entry, len(messages))
+            
+            # Descartar los mensajes más antiguos si se supera el límite por sesión
+            overflow = len(entry["messages"]) - self.max_messages
+            if overflow > 0:
+                removed = entry["messages"][:overflow]
+                del entry["messages"][:overflow]
+                entry["base"] += overflow
+                self._account(
+                    entry,
+                    -sum(m.stored_bytes for m in removed),
+                    -sum(m.size for m in removed)
+                )
+                self._counters["trimmed_messages"] += overflow
+            
+            self._evict(keep=session_id)
+    
+    def _clear(self, entry):
+        """Vaciar el historial y empezar una nueva generación (con el lock adquirido)"""
+        self._account(entry, -entry["bytes"], -entry["raw_bytes"])
+        entry["base"] += len(entry["messages"])
+        entry["messages"] = []
+        entry["summary"] = ""
+        entry["summary_upto"] = entry["base"]
+        entry["generation"] = next(self._generations)
+    
+    def reset(self, session_id):
+        """Vaciar el historial de una sesión. Devuelve True si la sesión existía"""
+        with self._lock:
+            existed = session_id in self._sessions
+            entry = self._touch(session_id, create=True)
+            self._clear(entry)
+            self._evict(keep=session_id)
+            return existed
+    
+    def session_ids(self, since=None, prefix=""):
+        """Instantánea de los IDs de sesión usados desde `since` (epoch) cuyo ID empieza por `prefix`"""
+        with self._lock:
+            return [
+                session_id for session_id, entry in self._sessions.items()
+                if session_id.startswith(prefix) and (since is None or entry["last_seen"] >= since)
+            ]
+    
+    def export(self, session_id):
+        """Copia serializable de una sesión sin alterar su posición LRU (None si ya no existe).
+        Solo se copian las referencias con el lock; la descompresión se hace fuera"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            messages = list(entry["messages"])
+            summary, summary_upto, base, last_seen = entry["summary"], entry["summary_upto"], entry["base"], entry["last_seen"]
+        return {
+            "session_id": session_id,
+            "messages": [message.to_dict() for message in messages],
+            "summary": summary,
+            "summary_upto": max(0, summary_upto - base),  # mensajes exportados que ya cubre el resumen
+            "last_access": datetime.fromtimestamp(last_seen).strftime("%Y-%m-%d %H:%M:%S")
+        }
+    
+    def restore(self, session_id, messages, summary="", summary_upto=0):
+        """Sustituir el contenido de una sesión por uno importado"""
+        overflow = max(0, len(messages) - self.max_messages)
+        messages = messages[overflow:]
+        with self._lock:
+            entry = self._touch(session_id, create=True)
+            self._clear(entry)
+            for message in messages:
+                record = Message(message["role"], message["content"])
+                entry["messages"].append(record)
+                self._account(entry, record.size, record.size)
+            self._compress_cold(entry, len(messages))
+            summary_bytes = len(summary.encode("utf-8"))
+            entry["summary"] = summary
+            entry["summary_upto"] = entry["base"] + max(0, summary_upto - overflow)
+            self._account(entry, summary_bytes, summary_bytes)
+            self._evict(keep=session_id)
+    
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+    
+    def __len__(self):
+        with self._lock:
+            self._evict()
+            return len(self._sessions)
+    
+    def stats(self):
+        """Contadores de ocupación y expulsiones para /health"""
+        with self._lock:
+            self._evict()
+            count = len(self._sessions)
+            largest = heapq.nlargest(5, self._sessions.items(), key=lambda item: item[1]["bytes"])
+            return {
+                "backend": "memory",
+                "sessions": count,
+                "max_sessions": self.max_sessions,
+                "bytes": self._total_bytes,
+                "raw_bytes": self._total_raw_bytes,
+                "compression_ratio": round(self._total_raw_bytes / self._total_bytes, 2) if self._total_bytes else None,
+                "avg_bytes_per_session": self._total_bytes // count if count else 0,
+                "largest_sessions": [{
+                    "session_id": session_id,
+                    "messages": len(entry["messages"]),
+                    "compressed_messages": sum(1 for m in entry["messages"] if m.compressed),
+                    "bytes": entry["bytes"],
+                    "raw_bytes": entry["raw_bytes"]
+                } for session_id, entry in largest],
+                "max_bytes": self.max_bytes,
+                "idle_ttl_seconds": self.idle_ttl,
+                "max_messages_per_session": self.max_messages,
+                **self._counters
+            }
+
+class SQLiteSessionStore:
+    """Almacenamiento de sesiones en SQLite (modo WAL) compartido entre workers.
+    Los mensajes se guardan como filas de solo inserción y las escrituras se agrupan en un hilo de fondo.
+    Cada proceso usa un pequeño pool de conexiones; las consultas y escrituras, que pueden esperar al bloqueo
+    de la base de datos, se ejecutan con run_blocking para no detener el bucle de eventos de gevent"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 1,
+            next_seq INTEGER NOT NULL DEFAULT 0,
+            summary TEXT NOT NULL DEFAULT '',
+            summary_upto INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions (last_access);
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, generation, seq);
+    """
+    
+    def __init__(self, path, max_sessions, idle_ttl, max_messages, max_bytes, flush_interval, cleanup_interval=60, pool_size=4):
+        self.path = path
+        self.pool_size = pool_size
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.cleanup_interval = cleanup_interval
+        self._pool = None  # conexiones libres del proceso
+        self._pool_pid = None
+        self._opened = 0
+        self._pool_lock = Lock()
+        self._pending = []  # operaciones pendientes de escribir: (tipo, session_id, mensajes, timestamp)
+        self._pending_by_session = Counter()  # mensajes aún no confirmados en disco por sesión
+        self._pending_lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._writer_pid = None
+        self._counters = {
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+            "evicted_bytes": 0,
+            "trimmed_messages": 0,
+            "flushes": 0,
+            "rows_written": 0,
+            "flush_errors": 0
+        }
+        self._execute(lambda conn: conn.executescript(self.SCHEMA))
+        atexit.register(self.flush)
+    
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    @contextmanager
+    def _connection(self):
+        """Tomar una conexión del pool del proceso (se abre uno nuevo tras un fork) y devolverla al terminar"""
+        with self._pool_lock:
+            if self._pool_pid != os.getpid():
+                self._pool, self._pool_pid, self._opened = queue.LifoQueue(), os.getpid(), 0
+            pool = self._pool
+            try:
+                conn = pool.get_nowait()
+            except queue.Empty:
+                conn = None
+                if self._opened < self.pool_size:
+                    self._opened += 1
+                    conn = self._open()
+        if conn is None:
+            conn = pool.get()
+        try:
+            yield conn
+        finally:
+            pool.put(conn)
+    
+    def _execute(self, fn):
+        """Ejecutar fn(conn) con una conexión del pool fuera del bucle de eventos"""
+        with self._connection() as conn:
+            return run_blocking(fn, conn)
+    
+    @staticmethod
+    def _transaction(conn, fn):
+        """Ejecutar fn(conn) en una transacción BEGIN IMMEDIATE, deshaciéndola si falla"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    
+    def _enqueue(self, kind, session_id, messages=()):
+        with self._pending_lock:
+            self._pending.append((kind, session_id, messages, time.time()))
+            self._pending_by_session[session_id] += len(messages)
+        self._ensure_writer()
+        self._wakeup.set()
+    
+    def _sync(self, session_id):
+        """Garantizar que se leen las escrituras propias pendientes de esta sesión"""
+        if self._pending_by_session.get(session_id):
+            self.flush()
+    
+    def flush(self):
+        """Escribir en una sola transacción todas las operaciones pendientes"""
+        with self._flush_lock:
+            with self._pending_lock:
+                operations, self._pending = self._pending, []
+            if not operations:
+                return
+            
+            try:
+                rows = self._execute(lambda conn: self._transaction(conn, lambda conn: self._apply(conn, operations)))
+            except sqlite3.Error as e:
+                logger.error(f"Error al guardar sesiones en {self.path}: {e}")
+                # Devolver las operaciones a la cola para reintentarlas en la siguiente escritura
+                with self._pending_lock:
+                    self._pending = operations + self._pending
+                    self._counters["flush_errors"] += 1
+                return
+            
+            with self._pending_lock:
+                for kind, session_id, messages, _ in operations:
+                    self._pending_by_session[session_id] -= len(messages)
+                    if self._pending_by_session[session_id] <= 0:
+                        del self._pending_by_session[session_id]
+                self._counters["flushes"] += 1
+                self._counters["rows_written"] += rows
+    
+    @staticmethod
+    def _apply(conn, operations):
+        """Escribir las operaciones pendientes dentro de la transacción abierta. Devuelve las filas insertadas"""
+        rows = 0
+        for kind, session_id, messages, timestamp in operations:
+            if kind == "ensure":
+                conn.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, created_at, last_access) VALUES (?, ?, ?)",
+                    (session_id, timestamp, timestamp)
+                )
+            if kind in ("ensure", "touch"):
+                conn.execute("UPDATE sessions SET last_access = MAX(last_access, ?) WHERE session_id = ?", (timestamp, session_id))
+                continue
+            row = conn.execute("SELECT generation, next_seq FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO sessions (session_id, created_at, last_access) VALUES (?, ?, ?)", (session_id, timestamp, timestamp))
+                row = (1, 0)
+            generation, next_seq = row
+            conn.executemany(
+                "INSERT INTO messages (session_id, generation, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(session_id, generation, next_seq + i, m["role"], m["content"], timestamp) for i, m in enumerate(messages)]
+            )
+            conn.execute(
+                "UPDATE sessions SET next_seq = ?, last_access = MAX(last_access, ?) WHERE session_id = ?",
+                (next_seq + len(messages), timestamp, session_id)
+            )
+            rows += len(messages)
+        return rows
+    
+    def _ensure_writer(self):
+        """Arrancar el hilo de escritura una vez por proceso"""
+        if self._writer_pid == os.getpid():
+            return
+        with self._pending_lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+        Thread(target=self._writer_loop, name="session-writer", daemon=True).start()
+    
+    def _writer_loop(self):
+        last_cleanup = time.monotonic()
+        while True:
+            self._wakeup.wait(self.cleanup_interval)
+            self._wakeup.clear()
+            # Esperar un poco para agrupar las escrituras que lleguen a la vez
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() - last_cleanup >= self.cleanup_interval:
+                    self.cleanup()
+                    last_cleanup = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error en el hilo de escritura de sesiones: {e}")
+    
+    def _delete_sessions(self, conn, session_ids, reason):
+        for session_id in session_ids:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._counters[reason] += len(session_ids)
+    
+    def cleanup(self):
+        """Aplicar la expiración por inactividad y los límites de sesiones, mensajes y bytes"""
+        try:
+            self._execute(lambda conn: self._transaction(conn, self._cleanup))
+        except sqlite3.Error as e:
+            logger.error(f"Error al limpiar sesiones en {self.path}: {e}")
+    
+    def _cleanup(self, conn):
+        """Expulsiones y recortes dentro de la transacción abierta por cleanup"""
+        if self.idle_ttl > 0:
+            expired = [r[0] for r in conn.execute(
+                "SELECT session_id FROM sessions WHERE last_access < ?", (time.time() - self.idle_ttl,)
+            )]
+            self._delete_sessions(conn, expired, "evicted_ttl")
+        
+        # Mensajes de reinicios anteriores o por encima del máximo por sesión
+        trimmed = conn.execute("""
+            DELETE FROM messages WHERE id IN (
+                SELECT m.id FROM messages m JOIN sessions s ON m.session_id = s.session_id
+                WHERE m.generation < s.generation OR m.seq < s.next_seq - ?
+            )
+        """, (self.max_messages,)).rowcount
+        self._counters["trimmed_messages"] += max(trimmed, 0)
+        
+        overflow = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_sessions
+        if overflow > 0:
+            oldest = [r[0] for r in conn.execute(
+                "SELECT session_id FROM sessions ORDER BY last_access LIMIT ?", (overflow,)
+            )]
+            self._delete_sessions(conn, oldest, "evicted_lru")
+        
+        total_bytes = self._total_bytes(conn)
+        if total_bytes > self.max_bytes:
+            for session_id, size in conn.execute("""
+                SELECT s.session_id, COALESCE(SUM(LENGTH(CAST(m.content AS BLOB))), 0) + LENGTH(CAST(s.summary AS BLOB))
+                FROM sessions s LEFT JOIN messages m ON m.session_id = s.session_id
+                GROUP BY s.session_id ORDER BY s.last_access
+            """).fetchall():
+                if total_bytes <= self.max_bytes:
+                    break
+                self._delete_sessions(conn, [session_id], "evicted_bytes")
+                total_bytes -= size
+    
+    @staticmethod
+    def _total_bytes(conn):
+        messages_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) FROM messages").fetchone()[0]
+        summary_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(CAST(summary AS BLOB))), 0) FROM sessions").fetchone()[0]
+        return messages_bytes + summary_bytes
+    
+    def ensure(self, session_id):
+        """Crear la sesión si no existe. La creación se escribe agrupada con el resto de operaciones
+        pendientes, así que no se sabe aquí si la sesión era nueva: devuelve None"""
+        self._enqueue("ensure", session_id)
+    
+    def get_messages(self, session_id):
+        """Obtener el historial de la sesión (vacío si no existe)"""
+        self._sync(session_id)
+        rows = self._execute(lambda conn: conn.execute("""
+            SELECT m.role, m.content FROM messages m JOIN sessions s ON m.session_id = s.session_id
+            WHERE m.session_id = ? AND m.generation = s.generation AND m.seq >= s.next_seq - ?
+            ORDER BY m.seq
+        """, (session_id, self.max_messages)).fetchall())
+        return [{"role": role, "content": content} for role, content in rows]
+    
+    def get_context(self, session_id):
+        """Obtener el historial pendiente de resumir junto con el resumen acumulado de la sesión"""
+        self._sync(session_id)
+        
+        def read_context(conn):
+            row = conn.execute(
+                "SELECT generation, next_seq, summary, summary_upto FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            generation, next_seq, summary, summary_upto = row
+            start = max(summary_upto, next_seq - self.max_messages, 0)
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? AND generation = ? AND seq >= ? ORDER BY seq",
+                (session_id, generation, start)
+            ).fetchall()
+            return {
+                "messages": [{"role": role, "content": content} for role, content in rows],
+                "start": start,
+                "summary": summary,
+                "generation": generation
+            }
+        
+        context = self._execute(read_context)
+        if context is None:
+            return {"messages": [], "start": 0, "summary": "", "generation": None}
+        self._enqueue("touch", session_id)
+        return context
+    
+    def set_summary(self, session_id, generation, summary, upto):
+        """Guardar el resumen si la sesión no se ha reiniciado mientras se generaba"""
+        cursor = self._execute(lambda conn: conn.execute(
+            "UPDATE sessions SET summary = ?, summary_upto = ? WHERE session_id = ? AND generation = ? AND summary_upto < ?",
+            (summary, upto, session_id, generation, upto)
+        ))
+        return cursor.rowcount == 1
+    
+    def append(self, session_id, *messages):
+        """Añadir mensajes al historial; se escriben de forma agrupada en segundo plano"""
+        self._enqueue("append", session_id, list(messages))
+    
+    def reset(self, session_id):
+        """Vaciar el historial de una sesión. Devuelve True si la sesión existía"""
+        self.flush()
+        now = time.time()
+        
+        def reset_session(conn):
+            existed = conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+            if existed:
+                conn.execute("""
+                    UPDATE sessions SET generation = generation + 1, next_seq = 0, summary = '', summary_upto = 0, last_access = ?
+                    WHERE session_id = ?
+                """, (now, session_id))
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            else:
+                conn.execute("INSERT INTO sessions (session_id, created_at, last_access) VALUES (?, ?, ?)", (session_id, now, now))
+            return existed
+        
+        return self._execute(lambda conn: self._transaction(conn, reset_session))
+    
+    def session_ids(self, since=None, prefix=""):
+        """IDs de las sesiones usadas desde `since` (epoch) cuyo ID empieza por `prefix`"""
+        self.flush()
+        rows = self._execute(lambda conn: conn.execute(
+            "SELECT session_id FROM sessions WHERE substr(session_id, 1, ?) = ? AND last_access >= ? ORDER BY last_access",
+            (len(prefix), prefix, since or 0)
+        ).fetchall())
+        return [row[0] for row in rows]
+    
+    def export(self, session_id):
+        """Copia serializable de una sesión (None si ya no existe)"""
+        def read_session(conn):
+            row = conn.execute(
+                "SELECT generation, next_seq, summary, summary_upto, last_access FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            generation, next_seq = row[0], row[1]
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? AND generation = ? AND seq >= ? ORDER BY seq",
+                (session_id, generation, max(next_seq - self.max_messages, 0))
+            ).fetchall()
+            return row, rows
+        
+        found = self._execute(read_session)
+        if found is None:
+            return None
+        (generation, next_seq, summary, summary_upto, last_access), rows = found
+        first = max(next_seq - self.max_messages, 0)
+        return {
+            "session_id": session_id,
+            "messages": [{"role": role, "content": content} for role, content in rows],
+            "summary": summary,
+            "summary_upto": max(0, summary_upto - first),
+            "last_access": datetime.fromtimestamp(last_access).strftime("%Y-%m-%d %H:%M:%S")
+        }
+    
+    def restore(self, session_id, messages, summary="", summary_upto=0):
+        """Sustituir el contenido de una sesión por uno importado, en una sola transacción"""
+        overflow = max(0, len(messages) - self.max_messages)
+        messages = messages[overflow:]
+        self.flush()
+        now = time.time()
+        
+        def restore_session(conn):
+            conn.execute("INSERT OR IGNORE INTO sessions (session_id, generation, created_at, last_access) VALUES (?, 0, ?, ?)", (session_id, now, now))
+            conn.execute("""
+                UPDATE sessions SET generation = generation + 1, next_seq = ?, summary = ?, summary_upto = ?, last_access = ?
+                WHERE session_id = ?
+            """, (len(messages), summary, max(0, summary_upto - overflow), now, session_id))
+            generation = conn.execute("SELECT generation FROM sessions WHERE session_id = ?", (session_id,)).fetchone()[0]
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.executemany(
+                "INSERT INTO messages (session_id, generation, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(session_id, generation, i, m["role"], m["content"], now) for i, m in enumerate(messages)]
+            )
+        
+        self._execute(lambda conn: self._transaction(conn, restore_session))
+    
+    def __contains__(self, session_id):
+        return self._execute(lambda conn: conn.execute(
+            "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()) is not None
+    
+    def __len__(self):
+        return self._execute(lambda conn: conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0])
+    
+    def stats(self):
+        """Contadores de ocupación, expulsiones y escrituras para /health"""
+        total_bytes = self._execute(self._total_bytes)
+        with self._pending_lock:
+            pending = len(self._pending)
+            counters = dict(self._counters)
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "sessions": len(self),
+            "max_sessions": self.max_sessions,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_seconds": self.idle_ttl,
+            "max_messages_per_session": self.max_messages,
+            "pending_writes": pending,
+            **counters
+        }
+
+def create_session_store():
+    """Crear el almacenamiento de sesiones configurado en SESSION_BACKEND"""
+    limits = {
+        "max_sessions": SESSION_MAX_SESSIONS,
+        "idle_ttl": SESSION_IDLE_TTL,
+        "max_messages": SESSION_MAX_MESSAGES,
+        "max_bytes": SESSION_MAX_BYTES
+    }
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore(SESSION_DB_PATH, flush_interval=SESSION_FLUSH_INTERVAL, **limits)
+    return MemorySessionStore(
+        hot_messages=CONTEXT_KEEP_TURNS * 2,
+        compress_min_bytes=SESSION_COMPRESS_MIN_BYTES if SESSION_COMPRESS_COLD else None,
+        **limits
+    )
+
+# Almacenamiento de sesiones
+sessions = create_session_store()
+
+class OllamaClient:
+    """Cliente HTTP compartido para Ollama con conexiones persistentes (keep-alive) por worker"""
+    
+    def __init__(self, pool_connections, pool_maxsize, connect_timeout, read_timeout):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session = None
+        self._pid = None
+        self._lock = Lock()
+    
+    def _get_session(self):
+        """Obtener la sesión HTTP del proceso actual, creándola tras un fork de gunicorn"""
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_connections,
+                        pool_maxsize=self.pool_maxsize
+                    )
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers.update({
+                        "Content-Type": "application/json",
+                        "Connection": "keep-alive"
+                    })
+                    self._session = session
+                    self._pid = pid
+        return self._session
+    
+    def request(self, method, url, timeout=None, **kwargs):
+        """Realizar una petición reutilizando las conexiones del pool"""
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        return self._get_session().request(method, url, timeout=timeout, **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+    
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+# Cliente compartido por los endpoints de chat y completion
+ollama_client = OllamaClient(
+    pool_connections=OLLAMA_POOL_CONNECTIONS,
+    pool_maxsize=OLLAMA_POOL_MAXSIZE,
+    connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+    read_timeout=OLLAMA_READ_TIMEOUT
+)
+
+def is_backend_failure(error):
+    """Indicar si un error significa que el backend no está disponible (conexión, timeout o 5xx)"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return True
+
+class OllamaBackend:
+    """Estado de un nodo de Ollama dentro del pool"""
+    
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.in_flight = 0
+        self.latency = None  # media móvil exponencial en segundos
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_check = None
+
+class BackendPool:
+    """Reparte las peticiones entre varios nodos de Ollama y los retira de la rotación si fallan"""
+    
+    def __init__(self, urls, strategy, health_interval):
+        self.backends = [OllamaBackend(url) for url in urls]
+        self.strategy = strategy
+        self.health_interval = health_interval
+        self._lock = Lock()
+        self._probe_pid = None
+    
+    def __len__(self):
+        return len(self.backends)
+    
+    def _score(self, backend):
+        if self.strategy == "latency":
+            # Tiempo estimado hasta terminar: latencia observada por peticiones pendientes
+            return ((backend.latency or 0.0) * (backend.in_flight + 1), backend.in_flight)
+        return (backend.in_flight, backend.latency or 0.0)
+    
+    def pick(self, exclude=()):
+        """Elegir el backend sano con menos peticiones en curso (o menor latencia) y reservarlo"""
+        self._ensure_health_checks()
+        with self._lock:
+            candidates = [b for b in self.backends if b.url not in exclude] or self.backends
+            # Si ninguno está sano se prueba igualmente, por si la sonda aún no lo ha detectado
+            healthy = [b for b in candidates if b.healthy] or candidates
+            backend = min(healthy, key=self._score)
+            backend.in_flight += 1
+            backend.requests += 1
+            return backend
+    
+    def release(self, backend, elapsed=None, failed=False):
+        """Liberar la reserva de un backend registrando la latencia o el fallo"""
+        with self._lock:
+            backend.in_flight -= 1
+            if failed:
+                backend.failures += 1
+                backend.healthy = False
+            elif elapsed is not None:
+                backend.healthy = True
+                backend.latency = elapsed if backend.latency is None else 0.8 * backend.latency + 0.2 * elapsed
+    
+    def probe(self):
+        """Comprobar cada backend contra /api/tags y actualizar su estado"""
+        for backend in self.backends:
+            try:
+                response = ollama_client.get(f"{backend.url}/api/tags", timeout=(OLLAMA_CONNECT_TIMEOUT, 5))
+                response.raise_for_status()
+                healthy, error = True, None
+            except requests.exceptions.RequestException as e:
+                healthy, error = False, str(e)
+            with self._lock:
+                if backend.healthy != healthy:
+                    logger.info(f"Backend {backend.url} {'disponible' if healthy else 'fuera de rotación'}")
+                backend.healthy = healthy
+                backend.last_error = error
+                backend.last_check = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"Error en la sonda de salud de Ollama: {e}")
+    
+    def _ensure_health_checks(self):
+        """Arrancar las sondas de salud en segundo plano una vez por proceso"""
+        if self.health_interval <= 0 or self._probe_pid == os.getpid():
+            return
+        with self._lock:
+            if self._probe_pid == os.getpid():
+                return
+            self._probe_pid = os.getpid()
+        Thread(target=self._probe_loop, name="ollama-health", daemon=True).start()
+    
+    def stats(self):
+        with self._lock:
+            return [{
+                "url": b.url,
+                "healthy": b.healthy,
+                "in_flight": b.in_flight,
+                "latency_seconds": round(b.latency, 3) if b.latency is not None else None,
+                "requests": b.requests,
+                "failures": b.failures,
+                "last_check": b.last_check,
+                "last_error": b.last_error
+            } for b in self.backends]
+
+# Pool de nodos de Ollama
+backend_pool = BackendPool(OLLAMA_BACKENDS, strategy=OLLAMA_ROUTING, health_interval=OLLAMA_HEALTH_INTERVAL)
+
+class ModelWarmer:
+    """Precarga los modelos en todos los backends al arrancar y los mantiene residentes con pings periódicos.
+    El servicio se considera listo cuando al menos un backend tiene todos los modelos cargados.
+    Solo el worker que obtiene el bloqueo del fichero precarga y envía los pings; el resto lee el estado
+    que publica, así los backends no reciben el tráfico de precarga multiplicado por el número de workers"""
+    
+    def __init__(self, backends, models, keep_alive, timeout, retry_interval, ping_interval, directory):
+        self.models = models
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.ping_interval = ping_interval
+        self.lock_path = os.path.join(directory, "warmup.lock")
+        self.state_path = os.path.join(directory, "warmup.json")
+        self._state = {
+            backend.url: {"ready": False, "warmed_at": None, "load_seconds": None, "last_error": None}
+            for backend in backends
+        }
+        self._lock = Lock()
+        self._lock_file = None
+    
+    def start(self):
+        """Arrancar el hilo que intenta encargarse de la precarga de este despliegue"""
+        Thread(target=self._run_owner, name="model-warmup", daemon=True).start()
+    
+    def _run_owner(self):
+        # Si el worker que tenía el bloqueo muere, otro lo obtiene en el siguiente intento
+        while True:
+            self._lock_file = acquire_file_lock(self.lock_path)
+            if self._lock_file is not None:
+                break
+            time.sleep(self.retry_interval)
+        logger.info(f"Precarga de modelos activa en el proceso {os.getpid()}")
+        self._publish()
+        for url in self._state:
+            Thread(target=self._run, args=(url,), name="model-warmup", daemon=True).start()
+    
+    def _publish(self):
+        """Compartir el estado de la precarga con los demás workers"""
+        with self._lock:
+            state = {url: dict(entry) for url, entry in self._state.items()}
+        try:
+            write_json_atomic(self.state_path, state)
+        except OSError as e:
+            logger.error(f"No se pudo guardar el estado de la precarga: {e}")
+    
+    def _shared_state(self):
+        """Estado propio si este worker hace la precarga; si no, el publicado por el que la hace"""
+        if self._lock_file is None:
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                if isinstance(state, dict):
+                    return state
+            except (OSError, ValueError):
+                pass
+        with self._lock:
+            return {url: dict(entry) for url, entry in self._state.items()}
+    
+    def warm(self, url):
+        """Cargar los modelos con peticiones vacías (Ollama solo los carga en memoria, sin generar)"""
+        started = time.monotonic()
+        load_duration = 0
+        for model in self.models:
+            data = {"model": model, "prompt": "", "stream": False}
+            if self.keep_alive:
+                data["keep_alive"] = self.keep_alive
+            try:
+                response = ollama_client.post(f"{url}/api/generate", json=data, timeout=(OLLAMA_CONNECT_TIMEOUT, self.timeout))
+                response.raise_for_status()
+                load_duration += response.json().get("load_duration") or 0
+            except (requests.exceptions.RequestException, ValueError) as e:
+                with self._lock:
+                    self._state[url]["ready"] = False
+                    self._state[url]["last_error"] = f"{model}: {e}"
+                return False
+        
+        elapsed = time.monotonic() - started
+        with self._lock:
+            if not self._state[url]["ready"]:
+                logger.info(f"Modelos {', '.join(self.models)} cargados en {url} en {elapsed:.1f}s")
+            self._state[url].update({
+                "ready": True,
+                "warmed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "load_seconds": round(load_duration / 1e9, 3) if load_duration else round(elapsed, 3),
+                "last_error": None
+            })
+        return True
+    
+    def _run(self, url):
+        while not self.warm(url):
+            self._publish()
+            logger.error(f"No se pudo precargar el modelo en {url}: {self._state[url]['last_error']}")
+            time.sleep(self.retry_interval)
+        self._publish()
+        if self.ping_interval <= 0:
+            return
+        # Renovar el keep_alive antes de que Ollama descargue el modelo
+        while True:
+            time.sleep(self.ping_interval)
+            warmed = self.warm(url)
+            self._publish()
+            if not warmed:
+                logger.error(f"Ping de keep-alive fallido en {url}: {self._state[url]['last_error']}")
+    
+    def is_ready(self):
+        return any(state.get("ready") for state in self._shared_state().values())
+    
+    def stats(self):
+        return [{"url": url, **state} for url, state in self._shared_state().items()]
+
+# Precarga del modelo en los backends
+model_warmer = ModelWarmer(
+    backend_pool.backends,
+    [MODEL_NAME] + ([MODEL_FAST_NAME] if MODEL_FAST_NAME and MODEL_FAST_NAME != MODEL_NAME else []),
+    keep_alive=MODEL_KEEP_ALIVE,
+    timeout=WARMUP_TIMEOUT,
+    retry_interval=WARMUP_RETRY_INTERVAL,
+    ping_interval=KEEP_ALIVE_PING_INTERVAL,
+    directory=CRAWL_CACHE_DIR
+)
+
+def estimate_tokens(text):
+    """Estimación rápida del número de tokens (aprox. 4 caracteres por token)"""
+    return len(text) // 4 + 1
+
+class ContextWindow:
+    """Mantiene el historial enviado al modelo dentro de un presupuesto de tokens.
+    Conserva los últimos turnos literalmente y resume en segundo plano los anteriores"""
+    
+    def __init__(self, store, max_tokens, keep_turns, summarize):
+        self.store = store
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summarize = summarize
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+        self._pending = set()
+        self._lock = Lock()
+    
+    def build(self, session_id, stored=None):
+        """Devolver (resumen, mensajes recientes) que caben en el presupuesto de tokens.
+        `stored` es el contexto ya leído del almacén en esta petición (se lee si no se pasa)"""
+        context = stored or self.store.get_context(session_id)
+        summary = context["summary"]
+        messages = context["messages"]
+        
+        # Conservar como máximo los últimos N turnos (usuario + asistente)
+        recent = messages[-self.keep_turns * 2:] if self.keep_turns > 0 else []
+        
+        # Descartar los mensajes más antiguos hasta respetar el presupuesto
+        budget = self.max_tokens - (estimate_tokens(summary) if summary else 0)
+        used = sum(estimate_tokens(m["content"]) for m in recent)
+        while recent and used > budget:
+            used -= estimate_tokens(recent[0]["content"])
+            recent = recent[1:]
+        
+        # Los mensajes que quedan fuera de la ventana se integran en el resumen
+        folded = messages[:len(messages) - len(recent)]
+        if folded and self.summarize:
+            self._schedule_summary(session_id, context["generation"], summary, folded, context["start"] + len(folded))
+        
+        return summary, [{"role": m["role"], "content": m["content"]} for m in recent]
+    
+    def _schedule_summary(self, session_id, generation, summary, folded, upto):
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        self._executor.submit(self._summarize, session_id, generation, summary, folded, upto)
+    
+    def _summarize(self, session_id, generation, summary, folded, upto):
+        """Generar el nuevo resumen acumulado con Ollama (se ejecuta fuera del hilo de la petición)"""
+        try:
+            conversation = "\n".join(
+                f"{'Usuario' if m['role'] == 'user' else 'Curiosity'}: {m['content']}" for m in folded
+            )
+            prompt = (
+                "Resume de forma concisa la siguiente conversación entre un usuario y Curiosity, "
+                "conservando los competidores, datos y conclusiones mencionados.\n\n"
+            )
+            if summary:
+                prompt += f"Resumen previo:\n{summary}\n\n"
+            prompt += f"Nuevos mensajes:\n{conversation}\n\nResumen:"
+            
+            # El resumen también es una generación: cuenta contra el límite de admisión
+            with admission.slot(f"summary:{session_id}"):
+                new_summary = _request_ollama("/api/generate", {
+                    "model": MODEL_NAME,
+                    "prompt": prompt,
+                    "stream": False,
+                    "options": {
+                        "temperature": 0.2,
+                        "num_predict": max(64, self.max_tokens // 4)
+                    }
+                }, max_retries=2, extract=_extract_completion_content)
+            new_summary = (new_summary or "").strip()
+            if new_summary and new_summary not in ERROR_RESPONSES:
+                # Limitar el resumen a la mitad del presupuesto para dejar sitio a los turnos recientes
+                new_summary = new_summary[:self.max_tokens * 2]
+                self.store.set_summary(session_id, generation, new_summary, upto)
+        except AdmissionRejected as e:
+            # Se vuelve a intentar cuando la sesión reciba el siguiente turno
+            logger.info(f"Resumen de la sesión {session_id} aplazado por saturación: {e}")
+        except Exception as e:
+            logger.error(f"Error al resumir el historial de la sesión {session_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
+
+    def fingerprint(self, session_id, stored=None):
+        """Huella del historial que se enviaría al modelo (sin programar resúmenes)"""
+        context = stored or self.store.get_context(session_id)
+        recent = context["messages"][-self.keep_turns * 2:] if self.keep_turns > 0 else []
+        digest = hashlib.sha256(context["summary"].encode("utf-8"))
+        for message in recent:
+            digest.update(f"\x00{message['role']}\x00{message['content']}".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+# Ventana de contexto compartida por los constructores de prompts
+context_window = ContextWindow(
+    sessions,
+    max_tokens=CONTEXT_MAX_TOKENS,
+    keep_turns=CONTEXT_KEEP_TURNS,
+    summarize=CONTEXT_SUMMARY_ENABLED
+)
+
+def write_json_atomic(path, data):
+    """Escribir un JSON en disco de forma atómica (los lectores nunca ven un fichero a medias)"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def acquire_file_lock(path):
+    """Intentar tomar el bloqueo exclusivo del fichero sin esperar. Devuelve el fichero abierto, que hay que
+    mantener abierto mientras se quiera conservar el bloqueo, o None si lo tiene otro proceso"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    lock_file = open(path, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def normalize_prompt(prompt):
+    """Normalizar una consulta para la caché: minúsculas, sin tildes, puntuación ni espacios repetidos"""
+    text = unicodedata.normalize("NFKD", prompt.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def ngram_vector(text, n=3):
+    """Vector de n-gramas de caracteres normalizado, usado como embedding local ligero"""
+    padded = f" {text} "
+    counts = Counter(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {gram: v / norm for gram, v in counts.items()}
+
+def cosine_similarity(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(gram, 0.0) for gram, v in a.items())
+
+class ResponseCache:
+    """Caché de respuestas del modelo con nivel LRU en memoria, nivel opcional en disco y búsqueda por similitud"""
+    
+    def __init__(self, max_entries, ttl, directory="", similarity=0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.similarity = similarity
+        self._entries = OrderedDict()  # clave -> {"response", "expires", "scope", "vector"}
+        self._lock = Lock()
+        self._counters = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "hits_similar": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+    
+    @staticmethod
+    def make_scope(model, system_prompt, history=""):
+        """Ámbito de la clave: modelo, hash del prompt del sistema y huella opcional del historial"""
+        system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+        return f"{model}|{system_hash}|{history}"
+    
+    @staticmethod
+    def make_key(scope, normalized):
+        return hashlib.sha256(f"{scope}|{normalized}".encode("utf-8")).hexdigest()
+    
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+    
+    def _remember(self, key, response, expires, scope, normalized):
+        """Guardar en memoria (con el lock adquirido) expulsando las entradas menos usadas"""
+        self._entries[key] = {
+            "response": response,
+            "expires": expires,
+            "scope": scope,
+            "vector": ngram_vector(normalized) if self.similarity > 0 else None
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+    
+    def get(self, scope, prompt):
+        """Buscar una respuesta en memoria, en disco y por similitud. Devuelve None si no hay acierto"""
+        normalized = normalize_prompt(prompt)
+        key = self.make_key(scope, normalized)
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry["expires"] > now:
+                    self._entries.move_to_end(key)
+                    self._counters["hits_memory"] += 1
+                    return entry["response"]
+                del self._entries[key]
+        
+        if self.directory:
+            path = self._disk_path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    stored = json.load(f)
+                if stored["expires"] > now:
+                    with self._lock:
+                        self._remember(key, stored["response"], stored["expires"], scope, normalized)
+                        self._counters["hits_disk"] += 1
+                    return stored["response"]
+                os.remove(path)
+            except (OSError, ValueError, KeyError):
+                pass
+        
+        if self.similarity > 0:
+            vector = ngram_vector(normalized)
+            with self._lock:
+                best_key, best_score = None, 0.0
+                for candidate_key, entry in self._entries.items():
+                    if entry["scope"] != scope or entry["expires"] <= now:
+                        continue
+                    score = cosine_similarity(vector, entry["vector"])
+                    if score > best_score:
+                        best_key, best_score = candidate_key, score
+                if best_key is not None and best_score >= self.similarity:
+                    self._entries.move_to_end(best_key)
+                    self._counters["hits_similar"] += 1
+                    return self._entries[best_key]["response"]
+        
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+    
+    def put(self, scope, prompt, response):
+        """Guardar una respuesta válida en memoria y, si está configurado, en disco"""
+        if not response or not response.strip() or response in ERROR_RESPONSES:
+            return
+        normalized = normalize_prompt(prompt)
+        key = self.make_key(scope, normalized)
+        expires = time.time() + self.ttl
+        
+        with self._lock:
+            self._remember(key, response, expires, scope, normalized)
+            self._counters["stores"] += 1
+        
+        if self.directory:
+            path = self._disk_path(key)
+            try:
+                write_json_atomic(path, {"prompt": prompt, "response": response, "expires": expires})
+            except OSError as e:
+                logger.error(f"No se pudo guardar la respuesta en la caché de disco: {e}")
+    
+    def stats(self):
+        with self._lock:
+            hits = self._counters["hits_memory"] + self._counters["hits_disk"] + self._counters["hits_similar"]
+            lookups = hits + self._counters["misses"]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                **self._counters
+            }
+
+# Caché compartida de respuestas
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL,
+    directory=RESPONSE_CACHE_DIR,
+    similarity=RESPONSE_CACHE_SIMILARITY
+) if RESPONSE_CACHE_ENABLED else None
+
+def response_cache_scope(session_id, model=MODEL_NAME, stored=None):
+    """Ámbito de caché para una consulta de la sesión dada"""
+    history = context_window.fingerprint(session_id, stored) if RESPONSE_CACHE_HISTORY_AWARE else ""
+    system_prompt = ASSISTANT_CONTEXT
+    if retrieval_index is not None:
+        # Los fragmentos recuperados forman parte del prompt: un índice distinto invalida las respuestas guardadas
+        system_prompt = f"{CORE_SYSTEM_PROMPT}\x00{retrieval_index.version()}"
+    return ResponseCache.make_scope(model, system_prompt, history)
+
+def wants_cache(data):
+    """Comprobar si la petición permite usar la caché (campo 'no_cache' o cabecera Cache-Control)"""
+    if response_cache is None or data.get('no_cache'):
+        return False
+    return 'no-cache' not in request.headers.get('Cache-Control', '')
+
+class SingleFlight:
+    """Agrupa las llamadas idénticas en curso: la primera ejecuta la petición y las demás esperan su resultado"""
+    
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._calls = {}  # clave -> {"event", "result", "error", "waiters"}
+        self._lock = Lock()
+        self._counters = {
+            "leaders": 0,
+            "deduplicated": 0,
+            "timeouts": 0,
+            "errors_shared": 0
+        }
+    
+    def do(self, key, fn, timeout=None):
+        """Ejecutar fn() una sola vez por clave entre las peticiones concurrentes"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"event": Event(), "result": None, "error": None, "waiters": 0}
+                self._calls[key] = call
+                self._counters["leaders"] += 1
+            else:
+                call["waiters"] += 1
+                self._counters["deduplicated"] += 1
+        
+        if leader:
+            try:
+                call["result"] = fn()
+                return call["result"]
+            except BaseException as e:
+                call["error"] = e
+                raise
+            finally:
+                # Retirar la llamada antes de despertar a los que esperan, así las nuevas peticiones no reciben un resultado ya entregado
+                with self._lock:
+                    self._calls.pop(key, None)
+                call["event"].set()
+        
+        # Las peticiones agrupadas dejan de esperar al agotar su tiempo; la generación original continúa
+        if not call["event"].wait(self.timeout if timeout is None else min(self.timeout, timeout)):
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise TimeoutError("Tiempo de espera agotado aguardando una generación idéntica en curso")
+        if call["error"] is not None:
+            with self._lock:
+                self._counters["errors_shared"] += 1
+            raise call["error"]
+        return call["result"]
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "waiting": sum(call["waiters"] for call in self._calls.values()),
+                **self._counters
+            }
+
+# Agrupador de peticiones idénticas hacia Ollama
+coalescer = SingleFlight(timeout=COALESCE_TIMEOUT) if COALESCE_ENABLED else None
+
+def admitted(fn, admit, deadline=None):
+    """Envolver fn() para que ocupe un hueco de generación con la clave de admisión `admit` mientras se ejecuta"""
+    def run():
+        timeout = admission.queue_timeout if deadline is None else min(admission.queue_timeout, remaining_time(deadline))
+        with admission.slot(admit, timeout=timeout):
+            return fn()
+    return run
+
+def coalesce_request(endpoint, data, fn, deadline=None, admit=None):
+    """Ejecutar la petición a Ollama compartiéndola con otras idénticas en curso (mismo payload completo).
+    Con `admit`, solo la petición que ejecuta la llamada ocupa un hueco de generación; las agrupadas
+    esperan su resultado sin ocupar ninguno (AdmissionRejected se propaga a todas)"""
+    if admit is not None:
+        fn = admitted(fn, admit, deadline)
+    if coalescer is None:
+        return fn()
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    key = hashlib.sha256(f"{endpoint}|{payload}".encode("utf-8")).hexdigest()
+    try:
+        return coalescer.do(key, fn, timeout=remaining_time(deadline))
+    except TimeoutError as e:
+        logger.error(f"Error en petición agrupada a {endpoint}: {e}")
+        return MSG_COMMUNICATION_ERROR
+
+def request_deadline(requested=None):
+    """Instante límite (reloj monotónico) para responder: el plazo pedido por el cliente, acotado, o el configurado"""
+    try:
+        budget = float(requested or 0)
+    except (TypeError, ValueError):
+        budget = 0
+    budget = min(budget, REQUEST_DEADLINE_MAX) if budget > 0 else REQUEST_DEADLINE
+    return time.monotonic() + budget
+
+def remaining_time(deadline):
+    """Segundos que quedan hasta el plazo (None si la petición no tiene plazo)"""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+def ollama_timeout(deadline):
+    """Timeouts (conexión, lectura) de una petición a Ollama recortados al plazo restante"""
+    remaining = remaining_time(deadline)
+    if remaining is None:
+        return None
+    remaining = max(remaining, 0.001)  # requests no admite timeouts de 0
+    return (min(OLLAMA_CONNECT_TIMEOUT, remaining), min(OLLAMA_READ_TIMEOUT, remaining))
+
+class AdmissionRejected(Exception):
+    """La petición no se admite por saturación; se responde 429 con Retry-After"""
+    
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Limita las generaciones concurrentes hacia Ollama con una cola acotada y reparto justo entre sesiones"""
+    
+    def __init__(self, max_concurrent, max_queue, queue_timeout, max_per_session):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_per_session = max_per_session
+        self._active = 0
+        self._by_session = Counter()  # generaciones en curso o en cola por sesión
+        self._active_by_session = Counter()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._service_time = None  # media móvil de la duración de una generación
+        self._lock = Lock()
+        self._counters = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_session_limit": 0,
+            "rejected_timeout": 0
+        }
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+    
+    def _retry_after(self):
+        """Estimar en segundos cuándo habrá un hueco libre"""
+        service_time = self._service_time or 10.0
+        return max(1, math.ceil(service_time * (len(self._waiters) + 1) / self.max_concurrent))
+    
+    def _grant(self, session_id):
+        self._active += 1
+        self._active_by_session[session_id] += 1
+    
+    def _grant_next(self):
+        """Ceder los huecos libres a la sesión en espera con menos generaciones activas (y la más antigua)"""
+        while self._active < self.max_concurrent and self._waiters:
+            waiter = min(self._waiters, key=lambda w: (self._active_by_session[w["session_id"]], w["sequence"]))
+            self._waiters.remove(waiter)
+            self._grant(waiter["session_id"])
+            waiter["granted"] = True
+            waiter["event"].set()
+    
+    def _record_wait(self, waited):
+        self._counters["admitted"] += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+    
+    def acquire(self, session_id, timeout=None):
+        """Reservar un hueco de generación o lanzar AdmissionRejected"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._lock:
+            if self._by_session[session_id] >= self.max_per_session:
+                self._counters["rejected_session_limit"] += 1
+                raise AdmissionRejected("Demasiadas peticiones en curso para esta sesión", self._retry_after())
+            if self._active < self.max_concurrent and not self._waiters:
+                self._grant(session_id)
+                self._by_session[session_id] += 1
+                self._record_wait(0.0)
+                return
+            if len(self._waiters) >= self.max_queue:
+                self._counters["rejected_queue_full"] += 1
+                raise AdmissionRejected("El servicio está saturado", self._retry_after())
+            waiter = {"session_id": session_id, "event": Event(), "granted": False, "sequence": next(self._sequence)}
+            self._waiters.append(waiter)
+            self._by_session[session_id] += 1
+        
+        started = time.monotonic()
+        waiter["event"].wait(timeout)
+        with self._lock:
+            if not waiter["granted"]:
+                self._waiters.remove(waiter)
+                self._by_session[session_id] -= 1
+                self._counters["rejected_timeout"] += 1
+                raise AdmissionRejected("Tiempo de espera en cola agotado", self._retry_after())
+            self._record_wait(time.monotonic() - started)
+    
+    def release(self, session_id, elapsed=None):
+        """Liberar el hueco de la sesión y cederlo a la siguiente petición en cola"""
+        with self._lock:
+            self._active -= 1
+            self._active_by_session[session_id] -= 1
+            self._by_session[session_id] -= 1
+            if self._active_by_session[session_id] <= 0:
+                del self._active_by_session[session_id]
+            if self._by_session[session_id] <= 0:
+                del self._by_session[session_id]
+            if elapsed is not None:
+                self._service_time = elapsed if self._service_time is None else 0.8 * self._service_time + 0.2 * elapsed
+            self._grant_next()
+    
+    @contextmanager
+    def slot(self, session_id, timeout=None):
+        """Contexto que reserva un hueco de generación durante el bloque"""
+        self.acquire(session_id, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(session_id, time.monotonic() - started)
+    
+    def stats(self):
+        with self._lock:
+            admitted = self._counters["admitted"]
+            return {
+                "active": self._active,
+                "max_concurrent": self.max_concurrent,
+                "queue_depth": len(self._waiters),
+                "max_queue": self.max_queue,
+                "avg_wait_seconds": round(self._wait_total / admitted, 3) if admitted else 0.0,
+                "max_wait_seconds": round(self._wait_max, 3),
+                **self._counters
+            }
+
+# Control de admisión compartido por los endpoints que generan con Ollama
+admission = AdmissionController(
+    max_concurrent=ADMISSION_MAX_CONCURRENT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    max_per_session=ADMISSION_MAX_PER_SESSION
+)
+
+def rejected_response(error):
+    """Respuesta 429 con Retry-After para una petición no admitida"""
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+class Metrics:
+    """Contadores, histogramas y medidores en memoria expuestos en el formato de texto de Prometheus.
+    Cada worker de gunicorn mantiene sus propias series"""
+    
+    def __init__(self):
+        self._families = OrderedDict()  # nombre -> {"type", "help", "buckets", "series"}
+        self._gauges = OrderedDict()  # nombre -> (ayuda, función que devuelve [(etiquetas, valor)])
+        self._lock = Lock()
+    
+    def counter(self, name, help_text):
+        self._families[name] = {"type": "counter", "help": help_text, "buckets": None, "series": {}}
+    
+    def histogram(self, name, help_text, buckets):
+        self._families[name] = {"type": "histogram", "help": help_text, "buckets": buckets, "series": {}}
+    
+    def gauge(self, name, help_text, collect):
+        """Registrar un medidor cuyo valor se calcula al exportar las métricas"""
+        self._gauges[name] = (help_text, collect)
+    
+    def inc(self, name, labels=None, value=1):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._families[name]["series"]
+            series[key] = series.get(key, 0) + value
+    
+    def observe(self, name, value, labels=None):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            family = self._families[name]
+            state = family["series"].get(key)
+            if state is None:
+                state = family["series"][key] = {"buckets": [0] * len(family["buckets"]), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(family["buckets"]):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+    
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in labels
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+    
+    def render(self):
+        """Todas las series en el formato de exposición de texto de Prometheus"""
+        lines = []
+        with self._lock:
+            for name, family in self._families.items():
+                lines.append(f"# HELP {name} {family['help']}")
+                lines.append(f"# TYPE {name} {family['type']}")
+                for key, state in family["series"].items():
+                    if family["type"] == "counter":
+                        lines.append(f"{name}{self._labels(key)} {state}")
+                        continue
+                    for bound, count in zip(family["buckets"], state["buckets"]):
+                        lines.append(f"{name}_bucket{self._labels(key + (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{self._labels(key + (('le', '+Inf'),))} {state['count']}")
+                    lines.append(f"{name}_sum{self._labels(key)} {round(state['sum'], 6)}")
+                    lines.append(f"{name}_count{self._labels(key)} {state['count']}")
+        
+        for name, (help_text, collect) in self._gauges.items():
+            try:
+                values = collect()
+            except Exception as e:
+                logger.error(f"Error al calcular la métrica {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in values:
+                lines.append(f"{name}{self._labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+# Métricas del servicio
+metrics = Metrics()
+metrics.histogram("curiosity_http_request_duration_seconds", "Duración de las peticiones HTTP por ruta", METRICS_LATENCY_BUCKETS)
+metrics.histogram("curiosity_ollama_request_duration_seconds", "Latencia de las peticiones a Ollama por backend y endpoint", METRICS_LATENCY_BUCKETS)
+metrics.histogram("curiosity_ollama_time_to_first_token_seconds", "Tiempo hasta el primer fragmento en las respuestas en streaming", METRICS_LATENCY_BUCKETS)
+metrics.histogram("curiosity_ollama_tokens_per_second", "Velocidad de generación del modelo (eval_count / eval_duration)", METRICS_THROUGHPUT_BUCKETS)
+metrics.histogram("curiosity_ollama_load_duration_seconds", "Tiempo de carga del modelo informado por Ollama (load_duration)", METRICS_LATENCY_BUCKETS)
+metrics.histogram("curiosity_model_tier_duration_seconds", "Duración de las generaciones de chat por nivel de modelo", METRICS_LATENCY_BUCKETS)
+metrics.counter("curiosity_ollama_prompt_tokens_total", "Tokens de prompt evaluados por Ollama (prompt_eval_count)")
+metrics.counter("curiosity_ollama_generated_tokens_total", "Tokens generados por Ollama (eval_count)")
+metrics.counter("curiosity_ollama_eval_seconds_total", "Tiempo total de generación informado por Ollama (eval_duration)")
+metrics.counter("curiosity_ollama_retries_total", "Reintentos de peticiones a Ollama, incluido el cambio de backend")
+metrics.counter("curiosity_ollama_fallbacks_total", "Recurso a alternativas: URL alternativa tras un 403 o completion tras fallar el chat")
+metrics.gauge("curiosity_active_sessions", "Sesiones activas en el almacén de sesiones", lambda: [({}, len(sessions))])
+metrics.gauge("curiosity_admission_active", "Generaciones en curso", lambda: [({}, admission.stats()["active"])])
+metrics.gauge("curiosity_admission_queue_depth", "Peticiones esperando un hueco de generación", lambda: [({}, admission.stats()["queue_depth"])])
+metrics.gauge("curiosity_ollama_backend_in_flight", "Peticiones en curso por backend de Ollama",
+              lambda: [({"backend": b["url"]}, b["in_flight"]) for b in backend_pool.stats()])
+metrics.gauge("curiosity_ollama_backend_healthy", "Estado de salud de cada backend de Ollama (1 = sano)",
+              lambda: [({"backend": b["url"]}, int(b["healthy"])) for b in backend_pool.stats()])
+metrics.gauge("curiosity_log_records_dropped", "Registros de log descartados por cola llena", lambda: [({}, log_handler.dropped)])
+metrics.gauge("curiosity_log_records_suppressed", "Avisos y errores omitidos por el muestreo de logs", lambda: [({}, log_sampler.suppressed)])
+
+def record_ollama_usage(endpoint, response_data):
+    """Registrar los contadores de rendimiento que Ollama incluye en la respuesta final (duraciones en ns)"""
+    labels = {"endpoint": endpoint}
+    if response_data.get("prompt_eval_count"):
+        metrics.inc("curiosity_ollama_prompt_tokens_total", labels, response_data["prompt_eval_count"])
+    eval_count = response_data.get("eval_count")
+    eval_duration = response_data.get("eval_duration")
+    if eval_count:
+        metrics.inc("curiosity_ollama_generated_tokens_total", labels, eval_count)
+    if eval_count and eval_duration:
+        metrics.inc("curiosity_ollama_eval_seconds_total", labels, eval_duration / 1e9)
+        metrics.observe("curiosity_ollama_tokens_per_second", eval_count / (eval_duration / 1e9), labels)
+    if response_data.get("load_duration"):
+        metrics.observe("curiosity_ollama_load_duration_seconds", response_data["load_duration"] / 1e9, labels)
+
+RETRIEVAL_STOPWORDS = set("""
+a al con de del el en es la las lo los para por que se su sus un una y o como mas pero sobre entre
+the and of to in for on with is are
+""".split())
+
+def tokenize(text):
+    """Términos para el índice de recuperación: texto normalizado sin palabras vacías"""
+    return [term for term in normalize_prompt(text).split() if len(term) > 1 and term not in RETRIEVAL_STOPWORDS]
+
+def chunk_text(text, size):
+    """Dividir un texto en fragmentos de aproximadamente `size` caracteres respetando las palabras"""
+    chunks, current = [], []
+    length = 0
+    for word in text.split():
+        if length + len(word) > size and current:
+            chunks.append(" ".join(current))
+            current, length = [], 0
+        current.append(word)
+        length += len(word) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def knowledge_chunks(context):
+    """Fragmentar el contexto del asistente por secciones Markdown"""
+    chunks, title, lines = [], "", []
+    for line in context.strip().splitlines():
+        if line.startswith("#") and lines:
+            chunks.append((title, "\n".join(lines).strip()))
+            lines = []
+        if line.startswith("#"):
+            title = line.lstrip("#").strip()
+        lines.append(line)
+    if lines:
+        chunks.append((title, "\n".join(lines).strip()))
+    return chunks
+
+class RetrievalIndex:
+    """Índice BM25 local sobre el conocimiento de competidores y las páginas rastreadas, persistido en disco"""
+    
+    K1 = 1.5
+    B = 0.75
+    
+    def __init__(self, path, chunk_chars, reload_interval=30):
+        self.path = path
+        self.chunk_chars = chunk_chars
+        self.reload_interval = reload_interval
+        self._documents = {}  # id -> {"source", "title", "text", "length"}
+        self._postings = {}  # término -> {id: frecuencia}
+        self._sources = {}  # origen -> [ids]
+        self._total_length = 0
+        self._next_id = itertools.count()
+        self._mtime = None
+        self._last_reload_check = 0.0
+        self._version = None  # se recalcula al consultarla tras un cambio
+        self._lock = Lock()
+    
+    def version(self):
+        """Huella del contenido actual del índice, para invalidar las respuestas que se generaron con otro.
+        Depende solo del contenido, así que coincide entre workers con el mismo índice"""
+        self._maybe_reload()
+        with self._lock:
+            if self._version is None:
+                digest = hashlib.sha256()
+                for document in sorted(self._documents.values(), key=lambda d: (d["source"], d["title"], d["text"])):
+                    digest.update(f"{document['source']}\x00{document['title']}\x00{document['text']}\x00".encode("utf-8"))
+                self._version = digest.hexdigest()[:16]
+            return self._version
+    
+    def _add(self, source, title, text):
+        """Indexar un fragmento (con el lock adquirido)"""
+        doc_id = next(self._next_id)
+        terms = Counter(tokenize(f"{title} {text}"))
+        self._documents[doc_id] = {"source": source, "title": title, "text": text, "length": sum(terms.values())}
+        self._total_length += self._documents[doc_id]["length"]
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+        self._sources.setdefault(source, []).append(doc_id)
+    
+    def _remove_source(self, source):
+        for doc_id in self._sources.pop(source, []):
+            document = self._documents.pop(doc_id)
+            self._total_length -= document["length"]
+            for term in set(tokenize(f"{document['title']} {document['text']}")):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._postings[term]
+    
+    def upsert_source(self, source, title, chunks, persist=True):
+        """Sustituir los fragmentos de un origen (p. ej. una página) por su versión actual"""
+        with self._lock:
+            self._remove_source(source)
+            for chunk in chunks:
+                self._add(source, title, chunk)
+            self._version = None
+        if persist:
+            self.save()
+    
+    def upsert_text(self, source, title, text, persist=True):
+        self.upsert_source(source, title, chunk_text(text, self.chunk_chars), persist=persist)
+    
+    def save(self):
+        """Guardar los fragmentos en disco; los índices invertidos se reconstruyen al cargar"""
+        with self._lock:
+            data = [
+                {"source": d["source"], "title": d["title"], "text": d["text"]}
+                for d in self._documents.values() if d["source"] != "knowledge"
+            ]
+        try:
+            write_json_atomic(self.path, data)
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logger.error(f"No se pudo guardar el índice de recuperación: {e}")
+    
+    def load(self):
+        """Cargar los fragmentos persistidos. Devuelve False si no hay índice en disco"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            for source in [s for s in self._sources if s != "knowledge"]:
+                self._remove_source(source)
+            for document in data:
+                self._add(document["source"], document["title"], document["text"])
+            self._version = None
+            self._mtime = mtime
+        return True
+    
+    def _maybe_reload(self):
+        """Recargar el índice si otro worker (p. ej. el planificador) lo actualizó"""
+        now = time.monotonic()
+        if now - self._last_reload_check < self.reload_interval:
+            return
+        self._last_reload_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+    
+    def search(self, query, k):
+        """Devolver los k fragmentos más relevantes para la consulta según BM25"""
+        self._maybe_reload()
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._documents)
+            if not count or not terms:
+                return []
+            average_length = self._total_length / count or 1.0
+            scores = Counter()
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    length = self._documents[doc_id]["length"]
+                    scores[doc_id] += idf * frequency * (self.K1 + 1) / (
+                        frequency + self.K1 * (1 - self.B + self.B * length / average_length)
+                    )
+            return [dict(self._documents[doc_id], score=round(score, 3)) for doc_id, score in scores.most_common(k)]
+    
+    def stats(self):
+        with self._lock:
+            return {"documents": len(self._documents), "sources": len(self._sources), "terms": len(self._postings)}
+
+def build_system_prompt(query):
+    """Prompt de sistema: el contexto completo o, con recuperación, el prompt base y los fragmentos relevantes"""
+    if retrieval_index is None:
+        return ASSISTANT_CONTEXT
+    
+    system_prompt = CORE_SYSTEM_PROMPT
+    chunks = retrieval_index.search(query, RETRIEVAL_TOP_K)
+    if chunks:
+        system_prompt += "\n## Conocimiento relevante:\n\n" + "\n\n".join(
+            chunk["text"] if chunk["source"] == "knowledge" else f"[{chunk['title']}]\n{chunk['text']}"
+            for chunk in chunks
+        )
+    return system_prompt
+
+def retrieval_query(prompt, history):
+    """Consulta de recuperación: el mensaje actual y la última pregunta del usuario (para preguntas de seguimiento)"""
+    previous = [m["content"] for m in history if m["role"] == "user"]
+    return f"{previous[-1]} {prompt}" if previous else prompt
+
+def conversation_context(prompt, session_id, stored=None):
+    """Prompt de sistema, resumen y turnos recientes de la sesión, compartidos por el chat y su alternativa"""
+    summary, history = context_window.build(session_id, stored)
+    return {
+        "system": build_system_prompt(retrieval_query(prompt, history)),
+        "summary": summary,
+        "history": history
+    }
+
+def build_chat_messages(prompt, session_id, context=None):
+    """Construir la lista de mensajes (sistema, historial y usuario) para el endpoint de chat"""
+    messages = []
+    
+    context = context or conversation_context(prompt, session_id)
+    summary, history = context["summary"], context["history"]
+    
+    # Preparar el contexto del sistema
+    system_context = context["system"]
+    
+    # Agregar el contexto del sistema como primer mensaje
+    messages.append({
+        "role": "system",
+        "content": system_context
+    })
+    
+    # Agregar el resumen y los turnos recientes que caben en el presupuesto de contexto
+    if summary:
+        messages.append({
+            "role": "system",
+            "content": f"Resumen de la conversación anterior:\n{summary}"
+        })
+    messages.extend(history)
+    
+    # Agregar el nuevo mensaje del usuario
+    messages.append({
+        "role": "user",
+        "content": prompt
+    })
+    
+    return messages
+
+class ModelRouter:
+    """Elige el nivel de modelo (rápido o profundo) de cada consulta con rasgos locales baratos:
+    longitud, palabras clave de análisis, URLs y profundidad del historial"""
+    
+    TIERS = ("fast", "deep")
+    
+    def __init__(self, fast_model, deep_model, fast_max_chars, fast_max_history_turns, deep_keywords):
+        self.models = {"fast": fast_model or deep_model, "deep": deep_model}
+        self.enabled = bool(fast_model) and fast_model != deep_model
+        self.fast_max_chars = fast_max_chars
+        self.fast_max_history_turns = fast_max_history_turns
+        self.deep_keywords = tuple(normalize_prompt(k) for k in deep_keywords)
+        self._stats = {tier: {"requests": 0, "errors": 0, "latency_total": 0.0, "latency": None, "reasons": Counter()} for tier in self.TIERS}
+        self._lock = Lock()
+    
+    def classify(self, message, history_turns):
+        """Devolver (nivel, motivo) para el mensaje"""
+        if len(message) > self.fast_max_chars:
+            return "deep", "length"
+        if "http://" in message or "https://" in message or "www." in message:
+            return "deep", "url"
+        terms = normalize_prompt(message).split()
+        if any(term.startswith(self.deep_keywords) for term in terms):
+            return "deep", "keyword"
+        if history_turns > self.fast_max_history_turns:
+            return "deep", "history"
+        return "fast", "short"
+    
+    def route(self, message, history_turns, override=None):
+        """Devolver (nivel, modelo) para la consulta; `override` fuerza "fast" o "deep".
+        `history_turns` son los turnos guardados de la sesión, leídos una sola vez por quien llama"""
+        if not self.enabled:
+            tier, reason = "deep", "disabled"
+        elif override in self.TIERS:
+            tier, reason = override, "override"
+        else:
+            tier, reason = self.classify(message, history_turns)
+        with self._lock:
+            self._stats[tier]["reasons"][reason] += 1
+        return tier, self.models[tier]
+    
+    def record(self, tier, elapsed, failed=False):
+        """Registrar la latencia de una generación del nivel indicado"""
+        with self._lock:
+            stats = self._stats[tier]
+            stats["requests"] += 1
+            stats["errors"] += int(failed)
+            stats["latency_total"] += elapsed
+            stats["latency"] = elapsed if stats["latency"] is None else 0.8 * stats["latency"] + 0.2 * elapsed
+        metrics.observe("curiosity_model_tier_duration_seconds", elapsed, {"tier": tier, "model": self.models[tier]})
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "tiers": {tier: {
+                    "model": self.models[tier],
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "avg_latency_seconds": round(stats["latency_total"] / stats["requests"], 3) if stats["requests"] else None,
+                    "recent_latency_seconds": round(stats["latency"], 3) if stats["latency"] is not None else None,
+                    "reasons": dict(stats["reasons"])
+                } for tier, stats in self._stats.items()}
+            }
+
+# Enrutador de modelos para el chat
+model_router = ModelRouter(
+    MODEL_FAST_NAME,
+    MODEL_NAME,
+    fast_max_chars=ROUTER_FAST_MAX_CHARS,
+    fast_max_history_turns=ROUTER_FAST_MAX_HISTORY_TURNS,
+    deep_keywords=ROUTER_DEEP_KEYWORDS
+)
+
+def call_ollama_api(prompt, session_id, max_retries=3, deadline=None, context=None, model=MODEL_NAME, admit=True):
+    """Llamar a la API de Ollama con reintentos dentro del plazo de la petición.
+    Con admit, la llamada ocupa un hueco de generación de la sesión (False si quien llama ya lo tiene)"""
+    # Construir el mensaje para la API
+    messages = build_chat_messages(prompt, session_id, context)
+    
+    # Preparar los datos para la API
+    data = {
+        "model": model,
+        "messages": messages,
+        "stream": False,
+        "options": {
+            "temperature": 0.7
+        }
+    }
+    
+    return coalesce_request(
+        "/api/chat", data,
+        lambda: _request_ollama("/api/chat", data, max_retries, _extract_chat_content, deadline),
+        deadline,
+        admit=session_id if admit else None
+    )
+
+def _extract_chat_content(response_data):
+    """Extraer la respuesta según el formato del endpoint de chat"""
+    if "message" in response_data and "content" in response_data["message"]:
+        return response_data["message"]["content"]
+    return None
+
+def _extract_completion_content(response_data):
+    """Extraer la respuesta según el formato del endpoint de completion"""
+    return response_data.get("response")
+
+def _log_error_response(response, log_context):
+    """Registrar el detalle de una respuesta de error de Ollama, recortado a LOG_BODY_CHARS"""
+    try:
+        error_data = json.dumps(response.json(), ensure_ascii=False)
+    except ValueError:
+        error_data = response.text
+    logger.error("Error de Ollama: %s", error_data[:LOG_BODY_CHARS], extra=dict(log_context, status=response.status_code))
+
+def _post_to_backend(backend, endpoint, data, attempt, stream=False, timeout=None):
+    """Enviar la petición a un backend, probando la URL alternativa si responde 403 en el primer intento"""
+    log_context = {"backend": backend.url, "endpoint": endpoint, "attempt": attempt + 1}
+    logger.debug("Conectando a %s%s...", backend.url, endpoint, extra=log_context)
+    if MODEL_KEEP_ALIVE and "keep_alive" not in data:
+        data = dict(data, keep_alive=MODEL_KEEP_ALIVE)
+    response = ollama_client.post(f"{backend.url}{endpoint}", json=data, stream=stream, timeout=timeout)
+    
+    # Si hay un error, intentar mostrar el mensaje
+    if response.status_code >= 400:
+        if not stream:
+            _log_error_response(response, log_context)
+        
+        # Si obtenemos un 403, intentar con una URL alternativa
+        if response.status_code == 403 and attempt == 0 and OLLAMA_FALLBACK_URL:
+            response.close()
+            logger.info("Error 403, probando URL alternativa...", extra=log_context)
+            metrics.inc("curiosity_ollama_fallbacks_total", {"kind": "403_fallback_url"})
+            response = ollama_client.post(f"{OLLAMA_FALLBACK_URL}{endpoint}", json=data, stream=stream, timeout=timeout)
+    
+    return response
+
+def _request_ollama(endpoint, data, max_retries, extract, deadline=None):
+    """Enviar una petición a Ollama con reintentos, pasando al siguiente backend sin esperar si uno falla.
+    Con plazo, solo se reintenta mientras quede tiempo y cada intento se limita al tiempo restante"""
+    tried = set()
+    wait_time = 1
+    for attempt in range(max_retries):
+        # Solo se espera (retroceso exponencial) cuando todos los backends han fallado en esta ronda
+        if len(tried) >= len(backend_pool):
+            remaining = remaining_time(deadline)
+            if remaining is not None and remaining <= wait_time:
+                logger.error("Plazo agotado para %s tras %d intentos", endpoint, attempt, extra={"endpoint": endpoint})
+                break
+            logger.info("Reintentando en %s segundos...", wait_time, extra={"endpoint": endpoint})
+            time.sleep(wait_time)
+            wait_time *= 2
+            tried.clear()
+        elif remaining_time(deadline) == 0:
+            logger.error("Plazo agotado para %s tras %d intentos", endpoint, attempt, extra={"endpoint": endpoint})
+            break
+        
+        if attempt > 0:
+            metrics.inc("curiosity_ollama_retries_total", {"endpoint": endpoint})
+        
+        backend = backend_pool.pick(exclude=tried)
+        tried.add(backend.url)
+        started = time.monotonic()
+        labels = {"backend": backend.url, "endpoint": endpoint}
+        try:
+            response = _post_to_backend(backend, endpoint, data, attempt, timeout=ollama_timeout(deadline))
+            response.raise_for_status()
+            response_data = response.json()
+        except requests.exceptions.RequestException as e:
+            # Agotar el plazo de la petición no indica que el backend esté caído
+            backend_pool.release(backend, failed=is_backend_failure(e) and remaining_time(deadline) != 0)
+            elapsed = time.monotonic() - started
+            metrics.observe("curiosity_ollama_request_duration_seconds", elapsed, dict(labels, outcome="error"))
+            logger.error("Error en intento %d/%d con %s: %s", attempt + 1, max_retries, backend.url, e,
+                         extra=dict(labels, attempt=attempt + 1, duration_ms=round(elapsed * 1000)))
+            continue
+        
+        elapsed = time.monotonic() - started
+        backend_pool.release(backend, elapsed=elapsed)
+        metrics.observe("curiosity_ollama_request_duration_seconds", elapsed, dict(labels, outcome="ok"))
+        record_ollama_usage(endpoint, response_data)
+        logger.info("Respuesta de %s%s", backend.url, endpoint,
+                    extra=dict(labels, attempt=attempt + 1, duration_ms=round(elapsed * 1000)))
+        
+        content = extract(response_data)
+        if content is None:
+            logger.error("Formato de respuesta inesperado: %s", json.dumps(response_data, ensure_ascii=False)[:LOG_BODY_CHARS],
+                         extra=dict(labels, attempt=attempt + 1))
+            return MSG_UNEXPECTED_FORMAT
+        return content
+    
+    return MSG_COMMUNICATION_ERROR if max_retries > 0 else MSG_CONNECTION_FAILED
+
+def stream_ollama_api(prompt, session_id, deadline=None, model=MODEL_NAME, context=None):
+    """Llamar a la API de chat de Ollama en modo streaming, devolviendo los fragmentos a medida que llegan"""
+    data = {
+        "model": model,
+        "messages": build_chat_messages(prompt, session_id, context),
+        "stream": True,
+        "options": {
+            "temperature": 0.7
+        }
+    }
+    
+    # Conectar con el primer backend disponible; si falla antes de empezar, probar el siguiente
+    tried = set()
+    while True:
+        if tried:
+            metrics.inc("curiosity_ollama_retries_total", {"endpoint": "/api/chat"})
+        backend = backend_pool.pick(exclude=tried)
+        tried.add(backend.url)
+        started = time.monotonic()
+        labels = {"backend": backend.url, "endpoint": "/api/chat"}
+        try:
+            response = _post_to_backend(backend, "/api/chat", data, attempt=0, stream=True, timeout=ollama_timeout(deadline))
+            response.raise_for_status()
+            break
+        except requests.exceptions.RequestException as e:
+            backend_pool.release(backend, failed=is_backend_failure(e) and remaining_time(deadline) != 0)
+            elapsed = time.monotonic() - started
+            metrics.observe("curiosity_ollama_request_duration_seconds", elapsed, dict(labels, outcome="error"))
+            logger.error("Error de streaming con %s: %s", backend.url, e,
+                         extra=dict(labels, attempt=len(tried), duration_ms=round(elapsed * 1000)))
+            if len(tried) >= len(backend_pool) or remaining_time(deadline) == 0:
+                raise
+    
+    failed = None
+    first_token = True
+    try:
+        # Ollama envía un objeto JSON por línea hasta recibir "done": true
+        for line in response.iter_lines():
+            if not line:
+                continue
+            try:
+                chunk = json.loads(line)
+            except ValueError as e:
+                # Una línea corrupta es un fallo del backend, no una respuesta terminada
+                raise requests.exceptions.RequestException(f"Línea de streaming no válida: {e}") from e
+            if "error" in chunk:
+                raise requests.exceptions.RequestException(chunk["error"])
+            if remaining_time(deadline) == 0:
+                raise requests.exceptions.Timeout("Plazo de la petición agotado durante el streaming")
+            content = chunk.get("message", {}).get("content", "")
+            if content:
+                if first_token:
+                    first_token = False
+                    metrics.observe("curiosity_ollama_time_to_first_token_seconds", time.monotonic() - started, {"backend": backend.url})
+                yield content
+            if chunk.get("done"):
+                # El último objeto incluye los contadores de rendimiento del modelo
+                record_ollama_usage("/api/chat", chunk)
+                break
+    except requests.exceptions.RequestException as e:
+        failed = e
+        raise
+    finally:
+        response.close()
+        elapsed = time.monotonic() - started
+        if failed is not None:
+            backend_pool.release(backend, failed=is_backend_failure(failed) and remaining_time(deadline) != 0)
+        else:
+            backend_pool.release(backend, elapsed=elapsed)
+        metrics.observe("curiosity_ollama_request_duration_seconds", elapsed, dict(labels, outcome="error" if failed else "ok"))
+
+def call_ollama_completion(prompt, session_id, max_retries=3, deadline=None, context=None, model=MODEL_NAME, admit=True):
+    """Usar el endpoint de completion en lugar de chat (alternativa)"""
+    # Construir prompt completo con contexto e historial (reutilizando el del chat si ya se calculó)
+    context = context or conversation_context(prompt, session_id)
+    summary, history = context["summary"], context["history"]
+    full_prompt = context["system"] + "\n\n"
+    
+    if summary:
+        full_prompt += f"Resumen de la conversación anterior:\n{summary}\n\n"
+    
+    full_prompt += "Historial de conversación:\n"
+    
+    for msg in history:
+        role = "Usuario" if msg["role"] == "user" else "Curiosity"
+        full_prompt += f"{role}: {msg['content']}\n"
+    
+    full_prompt += f"\nUsuario: {prompt}\nCuriosity: "
+    
+    # Preparar datos para API de completion
+    data = {
+        "model": model,
+        "prompt": full_prompt,
+        "stream": False,
+        "options": {
+            "temperature": 0.7
+        }
+    }
+    
+    return coalesce_request(
+        "/api/generate", data,
+        lambda: _request_ollama("/api/generate", data, max_retries, _extract_completion_content, deadline),
+        deadline,
+        admit=session_id if admit else None
+    )
+
+def is_usable_response(response):
+    return bool(response and response.strip()) and response not in ERROR_RESPONSES
+
+# Hilos para las llamadas en paralelo del modo de cobertura (hedging)
+hedge_executor = ThreadPoolExecutor(max_workers=max(4, ADMISSION_MAX_CONCURRENT * 2), thread_name_prefix="hedge")
+
+def hedged_response(message, session_id, deadline, context, model=MODEL_NAME):
+    """Si el chat no responde en HEDGE_DELAY segundos, lanzar también completion (en el backend menos
+    ocupado) y quedarse con la primera respuesta válida. Cada llamada ocupa su propio hueco de generación,
+    así que la perdedora lo sigue contando hasta que termina dentro del plazo; si aún no había empezado,
+    se cancela"""
+    primary = hedge_executor.submit(call_ollama_api, message, session_id, deadline=deadline, context=context, model=model)
+    done, _ = wait([primary], timeout=min(HEDGE_DELAY, remaining_time(deadline)))
+    if done:
+        try:
+            response = primary.result()
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"Error al obtener respuesta: {e}")
+            response = None
+        if is_usable_response(response) or response in ERROR_RESPONSES:
+            return response
+        logger.info("El endpoint de chat no devolvió una respuesta, probando con completion...")
+        metrics.inc("curiosity_ollama_fallbacks_total", {"kind": "chat_to_completion"})
+        return call_ollama_completion(message, session_id, deadline=deadline, context=context, model=model)
+    
+    logger.info(f"Sin respuesta del chat tras {HEDGE_DELAY}s, lanzando completion en paralelo...")
+    metrics.inc("curiosity_ollama_fallbacks_total", {"kind": "hedge"})
+    hedge = hedge_executor.submit(call_ollama_completion, message, session_id, deadline=deadline, context=context, model=model)
+    
+    pending = {primary, hedge}
+    response = None
+    rejected = None
+    while pending:
+        done, pending = wait(pending, timeout=remaining_time(deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            try:
+                result = future.result()
+            except AdmissionRejected as e:
+                rejected = e
+                continue
+            except Exception as e:
+                logger.error(f"Error al obtener respuesta: {e}")
+                continue
+            if is_usable_response(result):
+                for loser in pending:
+                    loser.cancel()
+                return result
+            response = response or result
+    if response is None and rejected is not None:
+        raise rejected
+    return response or MSG_COMMUNICATION_ERROR
+
+def generate_with_model(message, session_id, deadline, context, model):
+    """Generar con el modelo indicado: chat y, si falla o llega vacío, completion (o ambos en paralelo con hedging)"""
+    if HEDGE_ENABLED:
+        return hedged_response(message, session_id, deadline, context, model)
+    try:
+        # Primero intentar con el endpoint de chat
+        response = call_ollama_api(message, session_id, deadline=deadline, context=context, model=model)
+        
+        # Si la respuesta está vacía, intentar con completion
+        if not response or response.strip() == "":
+            logger.info("El endpoint de chat no devolvió una respuesta, probando con completion...")
+            metrics.inc("curiosity_ollama_fallbacks_total", {"kind": "chat_to_completion"})
+            response = call_ollama_completion(message, session_id, deadline=deadline, context=context, model=model)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"Error al obtener respuesta: {e}")
+        logger.info("Probando con endpoint de completion alternativo...")
+        metrics.inc("curiosity_ollama_fallbacks_total", {"kind": "chat_to_completion"})
+        response = call_ollama_completion(message, session_id, deadline=deadline, context=context, model=model)
+    return response
+
+def generate_response(message, session_id, use_cache=True, deadline=None, model_tier=None):
+    """Obtener la respuesta del asistente consultando primero la caché de respuestas.
+    Toda la generación (cola, reintentos y alternativa) se ajusta al plazo de la petición"""
+    deadline = deadline or request_deadline()
+    log_session_id.set(session_id)
+    # El historial se lee una sola vez y lo comparten el enrutador, la caché y el prompt
+    stored = sessions.get_context(session_id)
+    tier, model = model_router.route(message, len(stored["messages"]) // 2, model_tier)
+    scope = None
+    if use_cache and response_cache is not None:
+        scope = response_cache_scope(session_id, model, stored)
+        cached = response_cache.get(scope, message)
+        if cached is not None:
+            return cached
+    
+    # El contexto se calcula una vez y lo comparten el chat y la alternativa de completion.
+    # Cada llamada a Ollama espera su hueco de generación (AdmissionRejected si el servicio está saturado),
+    # salvo las que se agrupan con una idéntica en curso
+    context = conversation_context(message, session_id, stored)
+    
+    started = time.monotonic()
+    response = generate_with_model(message, session_id, deadline, context, model)
+    model_router.record(tier, time.monotonic() - started, failed=not is_usable_response(response))
+    
+    # Si el modelo rápido falla, la consulta pasa al modelo principal mientras quede plazo
+    if tier == "fast" and not is_usable_response(response) and remaining_time(deadline) > 0:
+        logger.info(f"El modelo rápido no respondió, probando con {model_router.models['deep']}...")
+        metrics.inc("curiosity_ollama_fallbacks_total", {"kind": "fast_to_deep"})
+        tier, model = "deep", model_router.models["deep"]
+        started = time.monotonic()
+        response = generate_with_model(message, session_id, deadline, context, model)
+        model_router.record(tier, time.monotonic() - started, failed=not is_usable_response(response))
+        if scope is not None:
+            scope = response_cache_scope(session_id, model, stored)
+    
+    if scope is not None:
+        response_cache.put(scope, message, response)
+    
+    return response
+
+# Secciones de los informes de análisis competitivo, generadas en paralelo
+REPORT_SECTIONS = [
+    ("Análisis de competidores", "Analiza los principales competidores de Antares Innovate en IA conversacional (Aivo, Botmaker, IBM Watson Assistant, Botpress, etc.): oferta, modelo de negocio, propuesta de valor, fortalezas y debilidades."),
+    ("Tendencias del mercado", "Identifica las tendencias emergentes en IA conversacional, cómo influyen en los líderes del mercado y cómo puede aprovecharlas Antares Innovate."),
+    ("Benchmarking de funcionalidades", "Compara las funcionalidades, integraciones, capacidades técnicas y experiencia de usuario de los competidores frente a las soluciones AVA, ABI y AIH de Antares Innovate."),
+    ("Precios y modelos de negocio", "Evalúa las estrategias de precios de los competidores (suscripción, pago por uso, freemium) y recomienda un enfoque de precios y paquetización para Antares Innovate."),
+    ("Recomendaciones estratégicas", "Proporciona recomendaciones concretas, accionables y priorizadas, con oportunidades a corto y largo plazo y nichos donde Antares Innovate podría especializarse.")
+]
+
+REPORT_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+class ReportEngine:
+    """Genera informes en segundo plano a partir de trabajos en cola y los guarda en disco con un índice"""
+    
+    def __init__(self, directory, workers, section_parallelism):
+        self.directory = directory
+        self._jobs = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-job")
+        self._sections = ThreadPoolExecutor(max_workers=section_parallelism, thread_name_prefix="report-section")
+        self._index_cache = (None, [])  # (mtime, entradas) del índice leído por última vez
+        self._lock = Lock()
+        self._owner = None  # (pid, token, fichero bloqueado) del proceso que ejecuta los trabajos
+        os.makedirs(os.path.join(self.directory, "owners"), exist_ok=True)
+    
+    def _owner_path(self, token):
+        return os.path.join(self.directory, "owners", f"{token}.lock")
+    
+    def _owner_token(self):
+        """Token de este proceso, respaldado por un bloqueo de fichero que se libera al morir el proceso"""
+        with self._lock:
+            if self._owner is None or self._owner[0] != os.getpid():
+                token = uuid.uuid4().hex
+                lock_file = open(self._owner_path(token), "w")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._owner = (os.getpid(), token, lock_file)
+            return self._owner[1]
+    
+    def _owner_alive(self, token):
+        """Comprobar si el proceso que encoló un trabajo sigue vivo (mantiene su bloqueo)"""
+        if not token:
+            return False
+        try:
+            with open(self._owner_path(token), "r") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True
+        # Nadie tenía el bloqueo: el proceso murió
+        try:
+            os.remove(self._owner_path(token))
+        except OSError:
+            pass
+        return False
+    
+    def recover_orphans(self):
+        """Marcar como fallidos los informes en cola o en curso cuyo proceso ya no existe (reinicio o
+        parada del servicio), para que /report/{id} no responda 202 indefinidamente"""
+        recovered = 0
+        for entry in list(self._index()):
+            if entry["status"] not in ("queued", "running"):
+                continue
+            record = self.get(entry["id"])
+            if record is None or record["status"] not in ("queued", "running") or self._owner_alive(record.get("owner")):
+                continue
+            record["status"] = "failed"
+            record["error"] = "La generación se interrumpió por un reinicio del servicio"
+            record["completed_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._save(record)
+            recovered += 1
+        if recovered:
+            logger.info(f"{recovered} informes interrumpidos marcados como fallidos")
+        return recovered
+    
+    def _path(self, report_id):
+        return os.path.join(self.directory, f"{report_id}.json")
+    
+    def _index_path(self):
+        return os.path.join(self.directory, "index.json")
+    
+    def _update_index(self, record):
+        """Añadir o actualizar la entrada del informe en el índice (protegido entre workers con flock)"""
+        entry = {key: record.get(key) for key in ("id", "type", "title", "status", "date", "created_at", "completed_at")}
+        with open(os.path.join(self.directory, "index.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            index = self._read_index_file()
+            index = [e for e in index if e["id"] != entry["id"]]
+            index.insert(0, entry)
+            index.sort(key=lambda e: e["created_at"], reverse=True)
+            write_json_atomic(self._index_path(), index)
+    
+    def _read_index_file(self):
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+    
+    def _index(self):
+        """Índice de informes, del más reciente al más antiguo (se relee solo si el fichero cambió)"""
+        try:
+            mtime = os.stat(self._index_path()).st_mtime_ns
+        except OSError:
+            return []
+        with self._lock:
+            if self._index_cache[0] != mtime:
+                self._index_cache = (mtime, self._read_index_file())
+            return self._index_cache[1]
+    
+    def _save(self, record):
+        write_json_atomic(self._path(record["id"]), record)
+        self._update_index(record)
+    
+    def submit(self, report_type="daily", params=None):
+        """Encolar un nuevo informe y devolver su registro sin esperar a que se genere"""
+        now = datetime.now()
+        params = {k: v for k, v in (params or {}).items() if v}
+        title = "Informe de Análisis Competitivo"
+        if params:
+            title += " - " + ", ".join(str(v) for v in params.values())
+        record = {
+            "id": str(uuid.uuid4()),
+            "type": report_type,
+            "title": title,
+            "params": params,
+            "status": "queued",
+            "date": now.strftime("%Y-%m-%d"),
+            "created_at": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "completed_at": None,
+            "sections": [],
+            "content": None,
+            "error": None,
+            "owner": self._owner_token()
+        }
+        self._save(record)
+        self._jobs.submit(self._run, dict(record))
+        return record
+    
+    @staticmethod
+    def competitors_hash(analyses):
+        """Huella combinada del contenido de los competidores analizados (vacía si no hay ninguno)"""
+        digest = hashlib.sha256()
+        for analysis in sorted(analyses, key=lambda a: a["url"]):
+            digest.update(f"{analysis['url']}\x00{analysis.get('content_hash')}\x00".encode("utf-8"))
+        return digest.hexdigest()
+    
+    @staticmethod
+    def competitors_context(analyses):
+        """Extracto de los análisis de competidores repartido en REPORT_COMPETITOR_CHARS caracteres"""
+        if not analyses:
+            return ""
+        budget = max(REPORT_COMPETITOR_CHARS // len(analyses), 200)
+        return "\n\n".join(
+            f"### {analysis['name']} ({analysis['url']}), analizado el {analysis['analyzed_at']}\n{analysis['analysis'][:budget]}"
+            for analysis in analyses
+        )
+    
+    def _generate_section(self, report_id, index, title, instruction, params, competitors=""):
+        """Generar una sección del informe con Ollama respetando el control de admisión"""
+        prompt = ASSISTANT_CONTEXT + "\n\n"
+        if competitors:
+            prompt += f"Análisis recientes de las webs de competidores (úsalos como fuente principal):\n{competitors}\n\n"
+        prompt += f"Redacta la sección \"{title}\" de un informe ejecutivo de análisis competitivo.\n{instruction}\n"
+        if params.get("focus_area"):
+            prompt += f"Enfoque del informe: {params['focus_area']}.\n"
+        if params.get("industry"):
+            prompt += f"Industria: {params['industry']}.\n"
+        if params.get("region"):
+            prompt += f"Región: {params['region']}.\n"
+        prompt += "Usa formato Markdown y no repitas el título de la sección.\n"
+        
+        data = {
+            "model": MODEL_NAME,
+            "prompt": prompt,
+            "stream": False,
+            "options": {
+                "temperature": 0.7
+            }
+        }
+        
+        # Los informes esperan su turno en lugar de fallar cuando el servicio está saturado
+        for attempt in range(3):
+            try:
+                return coalesce_request(
+                    "/api/generate", data,
+                    lambda: _request_ollama("/api/generate", data, 3, _extract_completion_content),
+                    admit=f"report:{report_id}:{index}"
+                )
+            except AdmissionRejected as e:
+                logger.info(f"Sección {title} del informe {report_id} en espera {e.retry_after}s: {e}")
+                time.sleep(e.retry_after)
+        return MSG_COMMUNICATION_ERROR
+    
+    def _run(self, record):
+        """Generar todas las secciones en paralelo y guardar el informe terminado"""
+        try:
+            record["status"] = "running"
+            # Los análisis que la última actualización de competidores dejó en disco
+            analyses = competitor_crawler.analyses()
+            record["competitors_hash"] = self.competitors_hash(analyses)
+            self._save(record)
+            competitors = self.competitors_context(analyses)
+            
+            futures = [
+                self._sections.submit(self._generate_section, record["id"], i, title, instruction, record["params"], competitors)
+                for i, (title, instruction) in enumerate(REPORT_SECTIONS)
+            ]
+            sections = []
+            for (title, _), future in zip(REPORT_SECTIONS, futures):
+                content = future.result()
+                sections.append({"title": title, "content": content, "ok": content not in ERROR_RESPONSES})
+            
+            record["sections"] = sections
+            record["content"] = f"# {record['title']} - {record['date']}\n\n" + "\n\n".join(
+                f"## {section['title']}\n\n{section['content']}" for section in sections
+            )
+            if any(section["ok"] for section in sections):
+                record["status"] = "completed"
+            else:
+                record["status"] = "failed"
+                record["error"] = "No se pudo generar ninguna sección del informe"
+        except Exception as e:
+            logger.error(f"Error al generar el informe {record['id']}: {e}")
+            record["status"] = "failed"
+            record["error"] = str(e)
+        
+        record["completed_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._save(record)
+    
+    def get(self, report_id):
+        """Leer un informe (o el estado de su trabajo) directamente de su fichero"""
+        if not REPORT_ID_PATTERN.match(report_id):
+            return None
+        try:
+            with open(self._path(report_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def list(self, page=1, per_page=20, status=None):
+        """Página del índice de informes, del más reciente al más antiguo"""
+        entries = self._index()
+        if status:
+            entries = [e for e in entries if e["status"] == status]
+        start = (page - 1) * per_page
+        return len(entries), entries[start:start + per_page]
+    
+    def latest(self, report_type=None):
+        """Último informe completado (del tipo indicado, si se indica)"""
+        for entry in self._index():
+            if entry["status"] == "completed" and (report_type is None or entry["type"] == report_type):
+                return self.get(entry["id"])
+        return None
+    
+    def stats(self):
+        entries = self._index()
+        completed = [e for e in entries if e["status"] == "completed"]
+        last_age = None
+        if completed and completed[0].get("completed_at"):
+            finished = datetime.strptime(completed[0]["completed_at"], "%Y-%m-%d %H:%M:%S")
+            last_age = round((datetime.now() - finished).total_seconds() / 3600, 2)
+        return {
+            "reports_count": len(completed),
+            "pending": sum(1 for e in entries if e["status"] in ("queued", "running")),
+            "last_report_age_hours": last_age
+        }
+
+# Motor de informes compartido por las rutas de informes
+report_engine = ReportEngine(REPORTS_DIR, workers=REPORT_WORKERS, section_parallelism=REPORT_SECTION_PARALLELISM)
+report_engine.recover_orphans()
+
+def report_summary(record):
+    """Representación pública de un informe para las respuestas JSON"""
+    summary = {
+        "id": record["id"],
+        "type": record["type"],
+        "title": record["title"],
+        "status": record["status"],
+        "date": record["date"],
+        "created_at": record["created_at"],
+        "completed_at": record["completed_at"]
+    }
+    if record["status"] in ("completed", "failed"):
+        summary["content"] = record["content"]
+        summary["sections"] = [{"title": s["title"], "content": s["content"]} for s in record["sections"]]
+        summary["error"] = record["error"]
+    return summary
+
+def extract_page_content(body, url):
+    """Extraer título, texto principal y enlaces de una página HTML con BeautifulSoup"""
+    soup = BeautifulSoup(body, "html.parser")
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    
+    # Enlaces absolutos sin fragmento, antes de eliminar la navegación
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        link = urldefrag(urljoin(url, anchor["href"]))[0]
+        if link.startswith(("http://", "https://")) and link not in links:
+            links.append(link)
+    
+    for tag in soup(["script", "style", "noscript", "svg", "iframe", "form", "nav", "header", "footer"]):
+        tag.decompose()
+    main = soup.find("main") or soup.find("article") or soup.body or soup
+    text = " ".join(main.get_text(" ").split())
+    
+    return {"title": title, "text": text, "links": links}
+
+class UnsafeURLError(ValueError):
+    """La URL no se puede rastrear: no es http(s) o apunta a una dirección interna"""
+
+def resolve_public_address(host, port):
+    """Resolver el host y devolver la dirección con la que conectar. Rechaza el host si alguna de sus
+    direcciones es privada, de loopback, link-local o reservada; los hosts de CRAWL_ALLOWED_HOSTS se
+    devuelven sin resolver"""
+    host = host.lower()
+    if host in CRAWL_ALLOWED_HOSTS:
+        return host
+    try:
+        addresses = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as e:
+        raise UnsafeURLError(f"No se pudo resolver {host}: {e}")
+    ips = []
+    for address in addresses:
+        ip = ipaddress.ip_address(address[4][0].split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise UnsafeURLError(f"{host} apunta a una dirección no pública ({ip})")
+        ips.append(str(ip))
+    return ips[0]
+
+def check_public_url(url):
+    """Rechazar URLs que no sean http(s) o cuyo host resuelva a una dirección privada, de loopback,
+    link-local o reservada, para que el rastreador no pueda usarse contra la red interna (SSRF)"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise UnsafeURLError(f"URL no válida: {url}")
+    resolve_public_address(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80))
+
+class PublicAddressConnection:
+    """Conexión que resuelve y valida el host en el mismo paso en que conecta, y conecta con la dirección
+    validada. Así un DNS que cambia de respuesta entre la comprobación y la conexión (DNS rebinding) no
+    puede dirigir el rastreador a la red interna. El nombre original se sigue usando para SNI y el certificado"""
+    
+    def _new_conn(self):
+        host = self._dns_host
+        self._dns_host = resolve_public_address(host, self.port)
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+class PublicHTTPConnection(PublicAddressConnection, HTTPConnection):
+    pass
 
-# Almacenamiento de sesiones
-sessions = {}
-sessions_lock = Lock()
+class PublicHTTPSConnection(PublicAddressConnection, HTTPSConnection):
+    pass
 
-def call_ollama_api(prompt, session_id, max_retries=3):
-    """Llamar a la API de Ollama con reintentos"""
-    headers = {
-        "Content-Type": "application/json"
-    }
+class PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = PublicHTTPConnection
+
+class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PublicHTTPSConnection
+
+class PublicAddressAdapter(HTTPAdapter):
+    """Adaptador de requests cuyas conexiones solo se abren contra direcciones públicas validadas"""
     
-    # Construir el mensaje para la API
-    messages = []
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": PublicHTTPConnectionPool, "https": PublicHTTPSConnectionPool}
+
+class CompetitorCrawler:
+    """Descarga en paralelo las webs de competidores con límites por host y revalidación por ETag/Last-Modified.
+    Solo se vuelven a analizar con BeautifulSoup las páginas cuyo contenido ha cambiado"""
     
-    # Preparar el contexto del sistema
-    system_context = ASSISTANT_CONTEXT
+    def __init__(self, cache_dir, max_pages, concurrency, per_host, host_delay, timeout):
+        self.cache_dir = cache_dir
+        self.max_pages = max_pages
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.timeout = timeout
+        self._fetch_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="crawler-fetch")
+        self._parse_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="crawler-parse")
+        self._pages = {}  # url -> página normalizada (caché en memoria del nivel en disco)
+        self._host_slots = {}
+        self._host_last_request = {}
+        self._session = None
+        self._pid = None
+        self._lock = Lock()
+        self._counters = {
+            "fetched": 0,
+            "not_modified": 0,
+            "unchanged": 0,
+            "parsed": 0,
+            "errors": 0
+        }
+        os.makedirs(os.path.join(self.cache_dir, "pages"), exist_ok=True)
+        os.makedirs(os.path.join(self.cache_dir, "analyses"), exist_ok=True)
     
-    # Agregar el contexto del sistema como primer mensaje
-    messages.append({
-        "role": "system",
-        "content": system_context
-    })
+    def _get_session(self):
+        """Sesión HTTP con conexiones persistentes, creada una vez por proceso"""
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = PublicAddressAdapter(pool_connections=8, pool_maxsize=self.per_host * 4)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers.update({"User-Agent": CRAWL_USER_AGENT})
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
     
-    # Agregar historial de conversación si existe la sesión
-    with sessions_lock:
-        if session_id in sessions:
-            messages.extend(sessions[session_id])
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
     
-    # Agregar el nuevo mensaje del usuario
-    messages.append({
-        "role": "user",
-        "content": prompt
-    })
+    @staticmethod
+    def _key(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
     
-    # Preparar los datos para la API
-    data = {
-        "model": MODEL_NAME,
-        "messages": messages,
-        "stream": False,
-        "options": {
-            "temperature": 0.7
-        }
-    }
+    def _load_json(self, kind, url):
+        try:
+            with open(os.path.join(self.cache_dir, kind, f"{self._key(url)}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
     
-    # Intentar con reintentos
-    for attempt in range(max_retries):
+    def _save_json(self, kind, url, data):
+        try:
+            write_json_atomic(os.path.join(self.cache_dir, kind, f"{self._key(url)}.json"), data)
+        except OSError as e:
+            logger.error(f"No se pudo guardar {kind} de {url}: {e}")
+    
+    def _cached_page(self, url):
+        with self._lock:
+            page = self._pages.get(url)
+        if page is None:
+            page = self._load_json("pages", url)
+            if page is not None:
+                with self._lock:
+                    self._pages[url] = page
+        return page
+    
+    def _store_page(self, page):
+        with self._lock:
+            self._pages[page["url"]] = page
+        self._save_json("pages", page["url"], page)
+    
+    @contextmanager
+    def _host_slot(self, url):
+        """Limitar las descargas simultáneas por host y espaciar las peticiones consecutivas"""
+        host = urlparse(url).netloc
+        with self._lock:
+            slot = self._host_slots.setdefault(host, BoundedSemaphore(self.per_host))
+        with slot:
+            with self._lock:
+                wait = self._host_last_request.get(host, 0) + self.host_delay - time.monotonic()
+                self._host_last_request[host] = time.monotonic() + max(wait, 0)
+            if wait > 0:
+                time.sleep(wait)
+            yield
+    
+    def _get(self, url, headers):
+        """GET en streaming que sigue las redirecciones a mano para validar cada salto con check_public_url.
+        La conexión vuelve a validar la dirección con la que conecta (PublicAddressAdapter)"""
+        for _ in range(CRAWL_MAX_REDIRECTS + 1):
+            check_public_url(url)
+            response = self._get_session().get(url, headers=headers, timeout=(5, self.timeout), stream=True, allow_redirects=False)
+            if not response.is_redirect:
+                return response
+            response.close()
+            url = urljoin(url, response.headers["Location"])
+        raise requests.exceptions.TooManyRedirects(f"Más de {CRAWL_MAX_REDIRECTS} redirecciones")
+    
+    @staticmethod
+    def _read_body(response):
+        """Leer como máximo CRAWL_MAX_BYTES del cuerpo y cerrar la conexión sin descargar el resto"""
+        chunks = []
+        size = 0
+        try:
+            for chunk in response.iter_content(64 * 1024):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= CRAWL_MAX_BYTES:
+                    break
+        finally:
+            response.close()
+        return b"".join(chunks)[:CRAWL_MAX_BYTES]
+    
+    def fetch_page(self, url):
+        """Descargar una página usando peticiones condicionales. Devuelve (página, cambiada)"""
+        cached = self._cached_page(url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        
         try:
-            logger.info(f"Conectando a {OLLAMA_URL}...")
-            response = requests.post(f"{OLLAMA_URL}/api/chat", headers=headers, json=data, timeout=180)
+            with self._host_slot(url):
+                response = self._get(url, headers)
+                if response.status_code == 304 and cached:
+                    response.close()
+                    self._count("not_modified")
+                    cached["checked_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    return cached, False
+                if response.status_code >= 400:
+                    response.close()
+                    response.raise_for_status()
+                body = self._read_body(response)
             
-            # Si hay un error, intentar mostrar el mensaje
-            if response.status_code >= 400:
-                try:
-                    error_data = response.json()
-                    logger.error(f"Error detallado: {error_data}")
-                except:
-                    logger.error(f"Contenido del error: {response.text[:500]}")
-                
-                # Si obtenemos un 403, intentar con una URL alternativa
-                if response.status_code == 403 and attempt == 0:
-                    logger.info("Error 403, probando URL alternativa...")
-                    alt_url = "http://127.0.0.1:11434/api/chat"
-                    response = requests.post(alt_url, headers=headers, json=data, timeout=180)
+            self._count("fetched")
+            content_hash = hashlib.sha256(body).hexdigest()
             
-            response.raise_for_status()
-            response_data = response.json()
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "checked_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
             
-            # Extraer la respuesta según el formato de Ollama
-            if "message" in response_data and "content" in response_data["message"]:
-                return response_data["message"]["content"]
-            else:
-                logger.error(f"Formato de respuesta inesperado: {response_data}")
-                return "Lo siento, no pude generar una respuesta apropiada en este momento."
+            # El servidor no admite peticiones condicionales pero el contenido no ha cambiado
+            if cached and cached["content_hash"] == content_hash:
+                self._count("unchanged")
+                cached.update(validators)
+                self._store_page(cached)
+                return cached, False
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error en intento {attempt+1}/{max_retries}: {str(e)}")
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt  # Retroceso exponencial
-                logger.info(f"Reintentando en {wait_time} segundos...")
-                time.sleep(wait_time)
+            # Analizar el HTML fuera del hilo de la petición. Con gevent los hilos del pool serían greenlets
+            # del mismo hilo del sistema, así que se usa el pool de hilos reales del hub
+            if GEVENT_PATCHED:
+                parsed = run_blocking(extract_page_content, body, response.url)
             else:
-                return f"Lo siento, estoy experimentando problemas técnicos de comunicación. ¿Podríamos intentarlo más tarde?"
+                parsed = self._parse_pool.submit(extract_page_content, body, response.url).result()
+            self._count("parsed")
+            page = {"url": url, "content_hash": content_hash, **parsed, **validators}
+            self._store_page(page)
+            return page, True
+        except (requests.exceptions.RequestException, UnsafeURLError) as e:
+            self._count("errors")
+            logger.error(f"Error al descargar {url}: {e}")
+            if cached:
+                return dict(cached, error=str(e)), False
+            return {"url": url, "error": str(e), "content_hash": None, "title": "", "text": "", "links": []}, False
     
-    return "No se pudo conectar al servicio. Por favor, inténtelo de nuevo más tarde."
+    def crawl(self, url):
+        """Descargar la URL del competidor y sus enlaces internos en paralelo"""
+        root, root_changed = self._fetch_pool.submit(self.fetch_page, url).result()
+        
+        host = urlparse(url).netloc
+        internal = [link for link in root.get("links", []) if urlparse(link).netloc == host and link != url]
+        internal = internal[:max(self.max_pages - 1, 0)]
+        futures = [self._fetch_pool.submit(self.fetch_page, link) for link in internal]
+        results = [(root, root_changed)] + [future.result() for future in futures]
+        
+        pages = [page for page, _ in results]
+        digest = hashlib.sha256()
+        for page in sorted(pages, key=lambda p: p["url"]):
+            digest.update(f"{page['url']}\x00{page.get('content_hash')}\x00".encode("utf-8"))
+        
+        return {
+            "url": url,
+            "name": root.get("title") or host,
+            "pages": pages,
+            "changed": [page["url"] for page, changed in results if changed],
+            "content_hash": digest.hexdigest()
+        }
+    
+    def load_analysis(self, url):
+        return self._load_json("analyses", url)
+    
+    def analyses(self):
+        """Todos los análisis guardados, del más reciente al más antiguo"""
+        directory = os.path.join(self.cache_dir, "analyses")
+        result = []
+        for filename in os.listdir(directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+                    result.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        result.sort(key=lambda a: a["analyzed_at"], reverse=True)
+        return result
+    
+    def save_analysis(self, analysis):
+        self._save_json("analyses", analysis["url"], analysis)
+    
+    def stats(self):
+        with self._lock:
+            return {"cached_pages": len(self._pages), **self._counters}
 
-def call_ollama_completion(prompt, session_id, max_retries=3):
-    """Usar el endpoint de completion en lugar de chat (alternativa)"""
-    headers = {
-        "Content-Type": "application/json"
-    }
+# Rastreador compartido de webs de competidores
+competitor_crawler = CompetitorCrawler(
+    CRAWL_CACHE_DIR,
+    max_pages=CRAWL_MAX_PAGES,
+    concurrency=CRAWL_CONCURRENCY,
+    per_host=CRAWL_PER_HOST,
+    host_delay=CRAWL_HOST_DELAY,
+    timeout=CRAWL_TIMEOUT
+)
+
+def build_retrieval_index():
+    """Construir el índice al arrancar: conocimiento base más las páginas y análisis rastreados"""
+    index = RetrievalIndex(RETRIEVAL_INDEX_PATH, chunk_chars=RETRIEVAL_CHUNK_CHARS)
+    with index._lock:
+        for title, text in knowledge_chunks(ASSISTANT_CONTEXT):
+            index._add("knowledge", title, text)
     
-    # Construir prompt completo con contexto e historial
-    full_prompt = ASSISTANT_CONTEXT + "\n\n"
+    if not index.load():
+        # Primer arranque: indexar lo que ya está en la caché del rastreador
+        pages_dir = os.path.join(CRAWL_CACHE_DIR, "pages")
+        for filename in os.listdir(pages_dir) if os.path.isdir(pages_dir) else []:
+            try:
+                with open(os.path.join(pages_dir, filename), "r", encoding="utf-8") as f:
+                    page = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if page.get("text"):
+                index.upsert_text(page["url"], page.get("title") or page["url"], page["text"], persist=False)
+        for analysis in competitor_crawler.analyses():
+            index.upsert_text(f"analysis:{analysis['url']}", f"Análisis de {analysis['name']}", analysis["analysis"], persist=False)
+        index.save()
+    return index
+
+# Índice de recuperación usado para construir los prompts
+retrieval_index = build_retrieval_index() if RETRIEVAL_ENABLED else None
+
+def analyze_competitor_site(url, force=False):
+    """Rastrear la web del competidor y analizarla con Ollama, reutilizando el análisis si el contenido no cambió"""
+    site = competitor_crawler.crawl(url)
     
-    full_prompt += "Historial de conversación:\n"
+    # Mantener el índice de recuperación al día con las páginas que cambiaron
+    if retrieval_index is not None:
+        for page in site["pages"]:
+            if page["url"] in site["changed"] and page.get("text"):
+                retrieval_index.upsert_text(page["url"], page.get("title") or page["url"], page["text"])
     
-    with sessions_lock:
-        if session_id in sessions:
-            for msg in sessions[session_id]:
-                role = "Usuario" if msg["role"] == "user" else "Curiosity"
-                full_prompt += f"{role}: {msg['content']}\n"
+    stored = competitor_crawler.load_analysis(url)
+    if stored and stored["content_hash"] == site["content_hash"] and not force:
+        return stored, site, True
     
-    full_prompt += f"\nUsuario: {prompt}\nCuriosity: "
+    content = ""
+    for page in site["pages"]:
+        if page.get("text"):
+            content += f"\n\n### {page.get('title') or page['url']}\n{page['text']}"
+    if not content:
+        raise ValueError(f"No se pudo obtener contenido de {url}")
+    content = content[:CRAWL_ANALYSIS_CHARS]
+    
+    prompt = ASSISTANT_CONTEXT + "\n\n"
+    prompt += f"Analiza el competidor {site['name']} ({url}) a partir del contenido de su web, "
+    prompt += "comparándolo con Antares Innovate e indicando fortalezas, debilidades, oportunidades y recomendaciones.\n"
+    prompt += f"\nContenido de la web:{content}\n\nAnálisis:"
     
-    # Preparar datos para API de completion
     data = {
         "model": MODEL_NAME,
-        "prompt": full_prompt,
+        "prompt": prompt,
         "stream": False,
         "options": {
             "temperature": 0.7
         }
     }
+    analysis_text = coalesce_request(
+        "/api/generate", data,
+        lambda: _request_ollama("/api/generate", data, 3, _extract_completion_content),
+        admit=f"competitor:{url}"
+    )
     
-    completion_url = f"{OLLAMA_URL}/api/generate"
+    analysis = {
+        "url": url,
+        "name": site["name"],
+        "content_hash": site["content_hash"],
+        "analysis": analysis_text,
+        "pages": [page["url"] for page in site["pages"] if not page.get("error")],
+        "analyzed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    if analysis_text not in ERROR_RESPONSES:
+        competitor_crawler.save_analysis(analysis)
+        if retrieval_index is not None:
+            retrieval_index.upsert_text(f"analysis:{url}", f"Análisis de {site['name']}", analysis_text)
+    return analysis, site, False
+
+class CompetitorScheduler:
+    """Actualiza los competidores y precalcula los informes fuera de horas punta.
+    Solo el worker que obtiene el bloqueo del fichero ejecuta las tareas"""
     
-    # Intentar con reintentos
-    for attempt in range(max_retries):
+    def __init__(self, urls, refresh_hours, report_times, directory):
+        self.urls = urls
+        self.refresh_hours = refresh_hours
+        self.report_times = report_times
+        self.lock_path = os.path.join(directory, "scheduler.lock")
+        self.state_path = os.path.join(directory, "scheduler.json")
+        self._scheduler = schedule.Scheduler()
+        self._lock_file = None
+        # Cambios de estado de las tareas, guardados por el bucle cuando la tarea ya se ha reprogramado
+        self._changes = {}
+    
+    def start(self):
+        """Arrancar el hilo que intenta convertirse en el planificador de este despliegue"""
+        Thread(target=self._run, name="scheduler", daemon=True).start()
+    
+    def _acquire_lock(self):
+        # Mantener el fichero abierto conserva el bloqueo mientras viva el proceso
+        self._lock_file = acquire_file_lock(self.lock_path)
+        return self._lock_file is not None
+    
+    def _schedule_jobs(self):
+        """Registrar las tareas antes de tomar el bloqueo; una hora mal escrita se descarta sin
+        impedir que se planifiquen las demás"""
+        self._scheduler.every(self.refresh_hours).hours.do(self.refresh_competitors).tag("competitors")
+        for at in self.report_times:
+            try:
+                self._scheduler.every().day.at(at).do(self.generate_daily_report).tag("report")
+            except (schedule.ScheduleValueError, ValueError) as e:
+                logger.error(f"Hora de informe no válida en REPORT_SCHEDULE_TIMES ({at!r}): {e}")
+    
+    def _run(self):
+        self._schedule_jobs()
+        
+        # Si el worker que tenía el bloqueo muere, otro lo obtiene en el siguiente intento
+        while not self._acquire_lock():
+            time.sleep(60)
+        logger.info(f"Planificador activo en el proceso {os.getpid()}")
+        
         try:
-            logger.info(f"Conectando a {completion_url}...")
-            response = requests.post(completion_url, headers=headers, json=data, timeout=180)
-            
-            response.raise_for_status()
-            response_data = response.json()
+            # Recuperar la actualización pendiente si la última es más antigua que el intervalo
+            state = self.state()
+            last_update = state.get("last_competitor_update")
+            if not last_update or (datetime.now() - datetime.strptime(last_update, "%Y-%m-%d %H:%M:%S")).total_seconds() > self.refresh_hours * 3600:
+                self.refresh_competitors()
+            self._save_state()
             
-            # Extraer respuesta del formato de completion
-            if "response" in response_data:
-                return response_data["response"]
-            else:
-                logger.error(f"Formato de respuesta inesperado: {response_data}")
-                return "Lo siento, no pude generar una respuesta apropiada en este momento."
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error en intento {attempt+1}/{max_retries}: {str(e)}")
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                logger.info(f"Reintentando en {wait_time} segundos...")
-                time.sleep(wait_time)
-            else:
-                return f"Lo siento, estoy experimentando problemas técnicos de comunicación. ¿Podríamos intentarlo más tarde?"
+            while True:
+                try:
+                    self._scheduler.run_pending()
+                except Exception as e:
+                    logger.error(f"Error en una tarea programada: {e}")
+                # Las próximas ejecuciones solo se conocen cuando la tarea ha terminado y schedule la reprograma
+                if self._changes:
+                    try:
+                        self._save_state()
+                    except OSError as e:
+                        logger.error(f"No se pudo guardar el estado del planificador: {e}")
+                time.sleep(30)
+        except Exception as e:
+            # Liberar el bloqueo para que otro worker tome el relevo
+            logger.error(f"El planificador se ha detenido: {e}")
+            self._lock_file.close()
+            self._lock_file = None
+    
+    def refresh_competitors(self):
+        """Actualizar los competidores; el análisis solo se regenera si su contenido cambió"""
+        regenerated, reused, failed = 0, 0, 0
+        for url in self.urls:
+            try:
+                _, _, cached = analyze_competitor_site(url)
+                if cached:
+                    reused += 1
+                else:
+                    regenerated += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"Error al actualizar el competidor {url}: {e}")
+        logger.info(f"Competidores actualizados: {regenerated} regenerados, {reused} sin cambios, {failed} con error")
+        self._changes["last_competitor_update"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    def generate_daily_report(self):
+        """Encolar el informe diario para que esté listo antes de las consultas, salvo que el contenido
+        de los competidores no haya cambiado desde el último: entonces se reutiliza ese informe"""
+        latest = report_engine.latest(report_type="daily")
+        if latest and latest.get("competitors_hash") == ReportEngine.competitors_hash(competitor_crawler.analyses()):
+            logger.info(f"Competidores sin cambios desde el informe {latest['id']}; se reutiliza")
+            self._changes["last_scheduled_report"] = latest["id"]
+            return
+        record = report_engine.submit("daily")
+        logger.info(f"Informe diario programado {record['id']} en cola")
+        self._changes["last_scheduled_report"] = record["id"]
+    
+    def _next_run(self, tag):
+        runs = [job.next_run for job in self._scheduler.get_jobs(tag) if job.next_run]
+        return min(runs).strftime("%Y-%m-%d %H:%M:%S") if runs else None
+    
+    def _save_state(self):
+        state = self.state()
+        state.update(self._changes)
+        self._changes = {}
+        state["next_scheduled_report"] = self._next_run("report")
+        state["next_competitor_update"] = self._next_run("competitors")
+        write_json_atomic(self.state_path, state)
+    
+    def state(self):
+        """Estado compartido del planificador, legible desde cualquier worker"""
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+# Planificador de actualizaciones de competidores e informes
+competitor_scheduler = CompetitorScheduler(
+    COMPETITORS_URLS,
+    refresh_hours=COMPETITOR_REFRESH_HOURS,
+    report_times=REPORT_SCHEDULE_TIMES,
+    directory=CRAWL_CACHE_DIR
+)
+if SCHEDULER_ENABLED:
+    competitor_scheduler.start()
+
+if WARMUP_ENABLED:
+    model_warmer.start()
+
+def accepted_encoding(available):
+    """Elegir la codificación preferida por el cliente entre las disponibles (br antes que gzip)"""
+    for encoding in ("br", "gzip"):
+        if encoding in available and request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+class HttpResponseCache:
+    """Respuestas ya serializadas y comprimidas de las rutas de consulta, reutilizadas durante un intervalo
+    y servidas con ETag para que los clientes que sondean reciban 304 sin cuerpo"""
     
-    return "No se pudo conectar al servicio. Por favor, inténtelo de nuevo más tarde."
+    def __init__(self, ttl, max_entries, compress_min_bytes, gzip_level):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.compress_min_bytes = compress_min_bytes
+        self.gzip_level = gzip_level
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+    
+    def _build(self, rv, expires):
+        response = app.make_response(rv)
+        body = response.get_data()
+        entry = {
+            "body": body,
+            "status": response.status_code,
+            "content_type": response.content_type,
+            "etag": hashlib.sha256(body).hexdigest()[:32],
+            "encoded": {},
+            "expires": expires
+        }
+        if len(body) >= self.compress_min_bytes:
+            entry["encoded"]["gzip"] = gzip.compress(body, self.gzip_level)
+            if brotli is not None:
+                entry["encoded"]["br"] = brotli.compress(body)
+        return entry
+    
+    def get(self, key, build, ttl):
+        """Devolver la entrada de `key`, generándola con `build()` si no existe o ha caducado"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry["expires"]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        
+        entry = self._build(build(), now + ttl)
+        # Solo se reutilizan las respuestas correctas; los estados intermedios (202, 404) se sirven siempre frescos
+        if entry["status"] == 200:
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+    
+    def respond(self, key, build, ttl=None):
+        """Servir la respuesta de `key` para la petición actual: 304 si el ETag coincide o el cuerpo en la
+        codificación preferida por el cliente. `ttl` por defecto es el del intervalo configurado"""
+        entry = self.get(key, build, self.ttl if ttl is None else ttl)
+        if entry["status"] == 200 and request.if_none_match.contains_weak(entry["etag"]):
+            with self._lock:
+                self.not_modified += 1
+            response = Response(status=304)
+        else:
+            encoding = accepted_encoding(entry["encoded"])
+            response = Response(entry["encoded"][encoding] if encoding else entry["body"],
+                                status=entry["status"], content_type=entry["content_type"])
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(entry["etag"], weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept-Encoding")
+        return response
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "brotli": brotli is not None
+            }
+
+# Caché de respuestas de las rutas de consulta (por worker)
+http_cache = HttpResponseCache(
+    ttl=HTTP_CACHE_TTL,
+    max_entries=HTTP_CACHE_MAX_ENTRIES,
+    compress_min_bytes=HTTP_COMPRESS_MIN_BYTES,
+    gzip_level=HTTP_GZIP_LEVEL
+)
+
+def compress_response(response):
+    """Comprimir con gzip el cuerpo de una respuesta grande si el cliente lo acepta"""
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < HTTP_COMPRESS_MIN_BYTES or not accepted_encoding(("gzip",)):
+        return response
+    response.set_data(gzip.compress(body, HTTP_GZIP_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.monotonic()
+    # El hilo puede venir de otra petición: no heredar su ID de sesión en los registros
+    log_session_id.set(None)
+
+@app.after_request
+def record_request_duration(response):
+    """Registrar la duración de la petición al cerrar la respuesta (incluye el streaming completo)"""
+    started = g.get("request_started")
+    if started is not None:
+        labels = {
+            "route": request.url_rule.rule if request.url_rule is not None else "unmatched",
+            "method": request.method,
+            "status": str(response.status_code)
+        }
+        response.call_on_close(lambda: metrics.observe("curiosity_http_request_duration_seconds", time.monotonic() - started, labels))
+    return response
 
 @app.route('/')
 def home():
     """Ruta de bienvenida básica con información de Antares Innovate"""
+    # El contenido solo cambia al reiniciar: se serializa una vez por worker
+    return http_cache.respond("home", build_home, ttl=float("inf"))
+
+def build_home():
     return jsonify({
         "message": "Curiosity - Agente de Investigación y Análisis Competitivo",
         "description": "Análisis de mercado y benchmarking para soluciones de IA conversacional",
@@ -235,18 +3686,34 @@ def home():
         "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "endpoints": {
             "/chat": "POST - Interactuar con Curiosity mediante mensajes",
+            "/chat/stream": "POST - Interactuar con Curiosity recibiendo la respuesta en streaming (SSE)",
+            "/chat/batch": "POST - Procesar varios mensajes en paralelo con resultados en NDJSON",
             "/reset": "POST - Reiniciar una sesión de conversación",
+            "/sessions/export": "GET - Exportar las sesiones en NDJSON (since, prefix)",
+            "/sessions/import": "POST - Importar sesiones en NDJSON (mode=replace|skip)",
             "/health": "GET - Verificar estado del servicio",
-            # Mantenemos las mismas rutas para compatibilidad con el frontend, pero ahora devolverán respuestas mínimas
-            "/report": "GET - Obtener el último informe (ruta mantenida para compatibilidad)",
-            "/reports": "GET - Listar todos los informes (ruta mantenida para compatibilidad)",
-            "/report/{id}": "GET - Obtener un informe específico (ruta mantenida para compatibilidad)",
-            "/generate-report": "POST - Solicitar un nuevo análisis (ruta mantenida para compatibilidad)",
-            "/competitors": "GET - Ver lista de competidores (ruta mantenida para compatibilidad)"
+            "/ready": "GET - Comprobar si el modelo está cargado y el servicio listo para recibir tráfico",
+            "/metrics": "GET - Métricas del servicio en formato Prometheus",
+            "/report": "GET - Obtener el último informe completado",
+            "/reports": "GET - Listar los informes con paginación (page, per_page, status)",
+            "/report/{id}": "GET - Obtener un informe específico o el estado de su generación",
+            "/generate-report": "POST - Encolar un nuevo análisis de mercado",
+            "/custom-report": "POST - Encolar un informe personalizado (focus_area, industry, region)",
+            "/competitors": "GET - Ver la lista de competidores analizados",
+            "/analyze-competitor": "POST - Analizar un competidor a partir de su web"
         },
         "contact": "Para más información, visite www.antaresinnovate.com"
     })
 
+def request_session_id(data):
+    """session_id de la petición ('default' si no se indica) o None si no es una cadena no vacía"""
+    session_id = data.get('session_id', 'default')
+    if isinstance(session_id, str) and session_id:
+        return session_id
+    return None
+
+INVALID_SESSION_ID = "El 'session_id' debe ser una cadena no vacía"
+
 @app.route('/chat', methods=['POST', 'OPTIONS'])
 def chat():
     """Endpoint para interactuar con el agente"""
@@ -256,41 +3723,225 @@ def chat():
         
     data = request.json
     
-    if not data or 'message' not in data:
-        return jsonify({"error": "Se requiere un 'message' en el JSON"}), 400
+    if not isinstance(data, dict) or not isinstance(data.get('message'), str):
+        return jsonify({"error": "Se requiere un 'message' de texto en el JSON"}), 400
+    
+    # Los clientes que aceptan SSE reciben la respuesta token a token
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return chat_stream()
     
     # Obtener mensaje y session_id (crear uno nuevo si no se proporciona)
     message = data.get('message')
-    session_id = data.get('session_id', 'default')
+    session_id = request_session_id(data)
+    if session_id is None:
+        return jsonify({"error": INVALID_SESSION_ID}), 400
     
     # Inicializar la sesión si es nueva
-    with sessions_lock:
-        if session_id not in sessions:
-            sessions[session_id] = []
+    sessions.ensure(session_id)
     
-    # Obtener respuesta del asistente 
+    # Obtener respuesta del asistente (desde la caché si es posible)
     try:
-        # Primero intentar con el endpoint de chat
-        response = call_ollama_api(message, session_id)
-        
-        # Si la respuesta está vacía, intentar con completion
-        if not response or response.strip() == "":
-            logger.info("El endpoint de chat no devolvió una respuesta, probando con completion...")
-            response = call_ollama_completion(message, session_id)
-    except Exception as e:
-        logger.error(f"Error al obtener respuesta: {e}")
-        logger.info("Probando con endpoint de completion alternativo...")
-        response = call_ollama_completion(message, session_id)
+        response = generate_response(
+            message, session_id,
+            use_cache=wants_cache(data),
+            deadline=request_deadline(data.get('deadline')),
+            model_tier=data.get('model_tier')
+        )
+    except AdmissionRejected as e:
+        return rejected_response(e)
     
     # Guardar la conversación en la sesión
-    with sessions_lock:
-        sessions[session_id].append({"role": "user", "content": message})
-        sessions[session_id].append({"role": "assistant", "content": response})
+    sessions.append(
+        session_id,
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": response}
+    )
     
-    return jsonify({
+    # Las respuestas largas en Markdown se envían comprimidas a los clientes que lo aceptan
+    return compress_response(jsonify({
         "response": response,
         "session_id": session_id
-    })
+    }))
+
+def sse_event(data, event=None):
+    """Formatear un evento Server-Sent Events con datos JSON"""
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event:
+        payload = f"event: {event}\n" + payload
+    return payload
+
+@app.route('/chat/stream', methods=['POST', 'OPTIONS'])
+def chat_stream():
+    """Endpoint para interactuar con el agente recibiendo la respuesta token a token (SSE)"""
+    # Manejo de solicitud OPTIONS para preflight CORS
+    if request.method == 'OPTIONS':
+        return '', 204
+        
+    data = request.json
+    
+    if not isinstance(data, dict) or not isinstance(data.get('message'), str):
+        return jsonify({"error": "Se requiere un 'message' de texto en el JSON"}), 400
+    
+    message = data.get('message')
+    session_id = request_session_id(data)
+    if session_id is None:
+        return jsonify({"error": INVALID_SESSION_ID}), 400
+    log_session_id.set(session_id)
+    
+    # Inicializar la sesión si es nueva
+    sessions.ensure(session_id)
+    
+    use_cache = wants_cache(data)
+    stored = sessions.get_context(session_id)
+    tier, model = model_router.route(message, len(stored["messages"]) // 2, data.get('model_tier'))
+    scope = response_cache_scope(session_id, model, stored) if use_cache else None
+    cached = response_cache.get(scope, message) if use_cache else None
+    deadline = request_deadline(data.get('deadline'))
+    
+    # Solo las respuestas que no están en caché ocupan un hueco de generación
+    if cached is None:
+        try:
+            admission.acquire(session_id, timeout=min(admission.queue_timeout, remaining_time(deadline)))
+        except AdmissionRejected as e:
+            return rejected_response(e)
+    
+    def generate():
+        parts = []
+        if cached is not None:
+            # Un acierto de caché se envía como un único fragmento
+            parts.append(cached)
+            yield sse_event({"token": cached})
+        else:
+            interrupted = False
+            context = None
+            started = time.monotonic()
+            try:
+                context = conversation_context(message, session_id, stored)
+                for token in stream_ollama_api(message, session_id, deadline=deadline, model=model, context=context):
+                    parts.append(token)
+                    yield sse_event({"token": token})
+                model_router.record(tier, time.monotonic() - started, failed=not "".join(parts).strip())
+            except Exception as e:
+                logger.error(f"Error en streaming: {e}")
+                model_router.record(tier, time.monotonic() - started, failed=True)
+                if parts:
+                    interrupted = True
+                    yield sse_event({"error": "La respuesta se interrumpió antes de completarse"}, event="error")
+            
+            # Si el stream falló o terminó vacío sin enviar nada útil, recurrir al endpoint de completion
+            if not interrupted and not "".join(parts).strip():
+                logger.info("El stream de chat no devolvió una respuesta, probando con completion...")
+                metrics.inc("curiosity_ollama_fallbacks_total", {"kind": "chat_to_completion"})
+                # El stream ya ocupa un hueco de generación
+                fallback = call_ollama_completion(
+                    message, session_id, deadline=deadline, model=model, admit=False,
+                    context=context or conversation_context(message, session_id, stored)
+                )
+                parts.append(fallback)
+                yield sse_event({"token": fallback})
+            
+            if use_cache and not interrupted:
+                response_cache.put(scope, message, "".join(parts))
+        
+        response = "".join(parts)
+        
+        # Guardar la conversación en la sesión una vez finalizado el stream
+        sessions.append(
+            session_id,
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": response}
+        )
+        
+        yield sse_event({"response": response, "session_id": session_id}, event="done")
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Evitar que proxies intermedios acumulen la respuesta
+        }
+    )
+    if cached is None:
+        # Liberar el hueco al cerrar la respuesta, aunque el cliente se desconecte antes de terminar
+        started = time.monotonic()
+        response.call_on_close(lambda: admission.release(session_id, time.monotonic() - started))
+    return response
+
+@app.route('/chat/batch', methods=['POST', 'OPTIONS'])
+def chat_batch():
+    """Procesar muchos mensajes a la vez, devolviendo cada resultado en NDJSON en cuanto termina"""
+    # Manejo de solicitud OPTIONS para preflight CORS
+    if request.method == 'OPTIONS':
+        return '', 204
+        
+    data = request.json
+    
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        return jsonify({"error": "Se requiere una lista 'items' con objetos {message, session_id}"}), 400
+    
+    items = data['items']
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"El lote admite como máximo {BATCH_MAX_ITEMS} elementos"}), 400
+    
+    try:
+        parallelism = max(1, min(int(data.get('parallelism', BATCH_MAX_PARALLELISM)), BATCH_MAX_PARALLELISM))
+    except (TypeError, ValueError):
+        return jsonify({"error": "El campo 'parallelism' debe ser un número entero"}), 400
+    batch_cache = wants_cache(data)
+    
+    # Los mensajes de una misma sesión se procesan en orden para no mezclar su historial
+    by_session = OrderedDict()
+    invalid = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('message'), str):
+            invalid.append((index, "Se requiere un 'message' de texto en el elemento"))
+            continue
+        session_id = request_session_id(item)
+        if session_id is None:
+            invalid.append((index, INVALID_SESSION_ID))
+            continue
+        by_session.setdefault(session_id, []).append((index, item))
+    
+    results = queue.Queue()
+    
+    def run_session(session_id, session_items):
+        for index, item in session_items:
+            message = item['message']
+            # Cualquier error (también del almacén de sesiones) se devuelve en el resultado del elemento:
+            # el stream espera exactamente un resultado por elemento válido
+            try:
+                sessions.ensure(session_id)
+                response = generate_response(
+                    message, session_id,
+                    use_cache=batch_cache and not item.get('no_cache'),
+                    deadline=request_deadline(item.get('deadline') or data.get('deadline')),
+                    model_tier=item.get('model_tier') or data.get('model_tier')
+                )
+                sessions.append(
+                    session_id,
+                    {"role": "user", "content": message},
+                    {"role": "assistant", "content": response}
+                )
+                results.put({"index": index, "session_id": session_id, "response": response})
+            except AdmissionRejected as e:
+                results.put({"index": index, "session_id": session_id, "error": str(e), "retry_after": e.retry_after})
+            except Exception as e:
+                logger.error(f"Error en el elemento {index} del lote: {e}")
+                results.put({"index": index, "session_id": session_id, "error": "No se pudo generar la respuesta"})
+    
+    executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="chat-batch")
+    for session_id, session_items in by_session.items():
+        executor.submit(run_session, session_id, session_items)
+    executor.shutdown(wait=False)
+    
+    def generate():
+        for index, error in invalid:
+            yield json.dumps({"index": index, "error": error}, ensure_ascii=False) + "\n"
+        for _ in range(len(items) - len(invalid)):
+            yield json.dumps(results.get(), ensure_ascii=False) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/reset', methods=['POST', 'OPTIONS'])
 def reset_session():
@@ -300,110 +3951,282 @@ def reset_session():
         return '', 204
         
     data = request.json or {}
-    session_id = data.get('session_id', 'default')
+    session_id = request_session_id(data)
+    if session_id is None:
+        return jsonify({"error": INVALID_SESSION_ID}), 400
     
-    with sessions_lock:
-        if session_id in sessions:
-            sessions[session_id] = []
-            message = f"Sesión {session_id} reiniciada correctamente"
-        else:
-            message = f"La sesión {session_id} no existía, se ha creado una nueva"
-            sessions[session_id] = []
+    if sessions.reset(session_id):
+        message = f"Sesión {session_id} reiniciada correctamente"
+    else:
+        message = f"La sesión {session_id} no existía, se ha creado una nueva"
     
     return jsonify({"message": message, "session_id": session_id})
 
+def parse_since(value):
+    """Convertir el parámetro `since` (epoch o fecha "YYYY-MM-DD[ HH:MM:SS]") en epoch"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def admin_denied():
+    """Respuesta de error si la petición no trae el token de administración (None si está autorizada).
+    Se acepta en la cabecera 'Authorization: Bearer <token>' o en 'X-Admin-Token'"""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Ruta de administración desactivada: configure ADMIN_TOKEN"}), 403
+    authorization = request.headers.get('Authorization', '')
+    token = authorization[7:] if authorization.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        return jsonify({"error": "Token de administración no válido"}), 401
+    return None
+
+@app.route('/sessions/export', methods=['GET', 'OPTIONS'])
+def export_sessions():
+    """Exportar las sesiones en NDJSON, una por línea, sin bloquear el almacén durante la descarga"""
+    # Manejo de solicitud OPTIONS para preflight CORS
+    if request.method == 'OPTIONS':
+        return '', 204
+    
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    
+    try:
+        since = parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({"error": "El parámetro 'since' debe ser un epoch o una fecha YYYY-MM-DD[ HH:MM:SS]"}), 400
+    prefix = request.args.get('prefix', '')
+    
+    # Instantánea de los IDs; cada sesión se copia y serializa por separado al enviarla
+    session_ids = sessions.session_ids(since=since, prefix=prefix)
+    
+    def generate():
+        for session_id in session_ids:
+            record = sessions.export(session_id)
+            if record is not None:
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={"X-Session-Count": str(len(session_ids))}
+    )
+
+@app.route('/sessions/import', methods=['POST', 'OPTIONS'])
+def import_sessions():
+    """Importar sesiones en NDJSON (formato de /sessions/export) leyendo el cuerpo línea a línea"""
+    # Manejo de solicitud OPTIONS para preflight CORS
+    if request.method == 'OPTIONS':
+        return '', 204
+    
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    
+    # replace: sustituye las sesiones existentes; skip: conserva las que ya existen
+    mode = request.args.get('mode', 'replace')
+    if mode not in ('replace', 'skip'):
+        return jsonify({"error": "El parámetro 'mode' debe ser 'replace' o 'skip'"}), 400
+    
+    imported, skipped, failed, errors = 0, 0, 0, []
+    for line_number, line in enumerate(request.stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict) or "session_id" not in record:
+                raise ValueError("Cada línea debe ser un objeto con 'session_id'")
+            # Los mismos IDs que aceptan los endpoints de chat, para que la sesión importada sea accesible
+            session_id = request_session_id(record)
+            if session_id is None:
+                raise ValueError(INVALID_SESSION_ID)
+            messages = record.get("messages", [])
+            if not isinstance(messages, list) or not all(
+                isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)
+                for m in messages
+            ):
+                raise ValueError("Se requiere una lista 'messages' de {role, content}")
+            summary = record.get("summary") or ""
+            if not isinstance(summary, str):
+                raise ValueError("El campo 'summary' debe ser una cadena")
+            if mode == 'skip' and session_id in sessions:
+                skipped += 1
+                continue
+            sessions.restore(
+                session_id,
+                [{"role": m["role"], "content": m["content"]} for m in messages],
+                summary=summary,
+                summary_upto=int(record.get("summary_upto") or 0)
+            )
+            imported += 1
+        except (ValueError, KeyError, TypeError, sqlite3.Error) as e:
+            if len(errors) < 20:
+                errors.append({"line": line_number, "error": str(e)})
+            failed += 1
+    
+    return jsonify({"imported": imported, "skipped": skipped, "failed": failed, "errors": errors})
+
 @app.route('/health', methods=['GET', 'OPTIONS'])
 def health_check():
     """Verificar estado del servicio con información adicional de Antares"""
     # Manejo de solicitud OPTIONS para preflight CORS
     if request.method == 'OPTIONS':
         return '', 204
-        
+    
+    return http_cache.respond("health", build_health)
+
+def build_health():
+    report_stats = report_engine.stats()
+    scheduler_state = competitor_scheduler.state()
     return jsonify({
         "status": "ok",
         "service_name": "Curiosity - Agente de Investigación y Análisis",
         "provider": "Antares Innovate",
         "model": MODEL_NAME,
         "ollama_url": OLLAMA_URL,
+        "backends": backend_pool.stats(),
+        "model_ready": not WARMUP_ENABLED or model_warmer.is_ready(),
+        "model_router": model_router.stats(),
+        "logging": logging_stats(),
+        "http_cache": http_cache.stats(),
         "active_sessions": len(sessions),
-        "reports_count": 0,  # Siempre 0 ya que no hay informes
-        "competitors_analyzed": 0,  # Siempre 0 ya que no hay competidores
-        "last_report_age_hours": "N/A",  # No aplicable
-        "last_competitor_update": "N/A",  # No aplicable
-        "next_scheduled_report": "N/A",  # No aplicable
+        "session_store": sessions.stats(),
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "coalescing": coalescer.stats() if coalescer is not None else None,
+        "admission": admission.stats(),
+        "crawler": competitor_crawler.stats(),
+        "retrieval_index": retrieval_index.stats() if retrieval_index is not None else None,
+        "reports_count": report_stats["reports_count"],
+        "reports_pending": report_stats["pending"],
+        "competitors_analyzed": len(competitor_crawler.analyses()),
+        "last_report_age_hours": report_stats["last_report_age_hours"] if report_stats["last_report_age_hours"] is not None else "N/A",
+        "last_competitor_update": scheduler_state.get("last_competitor_update") or "N/A",
+        "next_scheduled_report": scheduler_state.get("next_scheduled_report") or "N/A",
         "version": "1.0.0",
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     })
 
-# Rutas mantenidas para compatibilidad con el frontend pero con funcionalidad mínima
+@app.route('/ready', methods=['GET', 'OPTIONS'])
+def readiness_check():
+    """Indicar al balanceador si el modelo ya está cargado (503 mientras se precarga)"""
+    # Manejo de solicitud OPTIONS para preflight CORS
+    if request.method == 'OPTIONS':
+        return '', 204
+    
+    ready = not WARMUP_ENABLED or model_warmer.is_ready()
+    return jsonify({
+        "status": "ready" if ready else "warming_up",
+        "model": MODEL_NAME,
+        "backends": model_warmer.stats() if WARMUP_ENABLED else None
+    }), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET', 'OPTIONS'])
+def metrics_endpoint():
+    """Exponer las métricas del worker en el formato de texto de Prometheus"""
+    # Manejo de solicitud OPTIONS para preflight CORS
+    if request.method == 'OPTIONS':
+        return '', 204
+    
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Rutas de informes
 @app.route('/report', methods=['GET', 'OPTIONS'])
 def get_latest_report():
-    """Obtener el informe diario más reciente (mantenido para compatibilidad)"""
+    """Obtener el informe completado más reciente"""
     # Manejo de solicitud OPTIONS para preflight CORS
     if request.method == 'OPTIONS':
         return '', 204
-        
-    return jsonify({
-        "id": str(uuid.uuid4()),
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "content": "Esta funcionalidad no está disponible en esta versión. Por favor, use el chat para solicitar análisis de competidores o mercado."
-    })
+    
+    return http_cache.respond("report", build_latest_report)
+
+def build_latest_report():
+    record = report_engine.latest()
+    if record is None:
+        return jsonify({"error": "Aún no hay informes disponibles. Use POST /generate-report para generar uno."}), 404
+    
+    return jsonify(report_summary(record))
 
 @app.route('/reports', methods=['GET', 'OPTIONS'])
 def list_reports():
-    """Listar todos los informes disponibles (mantenido para compatibilidad)"""
+    """Listar los informes disponibles con paginación (?page=1&per_page=20&status=completed)"""
     # Manejo de solicitud OPTIONS para preflight CORS
     if request.method == 'OPTIONS':
         return '', 204
-        
+    
+    return http_cache.respond(f"reports?{request.query_string.decode('utf-8', 'replace')}", build_report_list)
+
+def build_report_list():
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+    total, entries = report_engine.list(page=page, per_page=per_page, status=request.args.get('status'))
+    
     return jsonify({
-        "count": 0,
-        "reports": []
+        "count": total,
+        "page": page,
+        "per_page": per_page,
+        "reports": entries
     })
 
 @app.route('/report/<report_id>', methods=['GET', 'OPTIONS'])
 def get_report_by_id(report_id):
-    """Obtener un informe específico por su ID (mantenido para compatibilidad)"""
+    """Obtener un informe específico por su ID, o el estado de su generación si aún no ha terminado"""
     # Manejo de solicitud OPTIONS para preflight CORS
     if request.method == 'OPTIONS':
         return '', 204
-        
-    return jsonify({
-        "id": report_id,
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "content": "Esta funcionalidad no está disponible en esta versión. Por favor, use el chat para solicitar análisis de competidores o mercado."
-    })
+    
+    return http_cache.respond(f"report/{report_id}", lambda: build_report(report_id))
+
+def build_report(report_id):
+    record = report_engine.get(report_id)
+    if record is None:
+        return jsonify({"error": f"No existe el informe {report_id}"}), 404
+    
+    status_code = 202 if record["status"] in ("queued", "running") else 200
+    return jsonify(report_summary(record)), status_code
 
 @app.route('/generate-report', methods=['POST', 'OPTIONS'])
 def force_report_generation():
-    """Forzar la generación de un nuevo informe (mantenido para compatibilidad)"""
+    """Encolar la generación de un nuevo informe de análisis competitivo"""
     # Manejo de solicitud OPTIONS para preflight CORS
     if request.method == 'OPTIONS':
         return '', 204
-        
-    report_id = str(uuid.uuid4())
+    
+    record = report_engine.submit("daily")
     return jsonify({
-        "message": "Esta funcionalidad no está disponible en esta versión.",
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "id": report_id,
-        "content": "Por favor, use el chat para solicitar análisis específicos de competidores o del mercado."
-    })
+        "message": "Informe en cola de generación",
+        "id": record["id"],
+        "status": record["status"],
+        "date": record["date"],
+        "status_url": f"/report/{record['id']}"
+    }), 202
 
 @app.route('/competitors', methods=['GET', 'OPTIONS'])
 def list_competitors():
-    """Listar competidores analizados (mantenido para compatibilidad)"""
+    """Listar los competidores analizados con su análisis precalculado"""
     # Manejo de solicitud OPTIONS para preflight CORS
     if request.method == 'OPTIONS':
         return '', 204
-        
+    
+    return http_cache.respond("competitors", build_competitor_list)
+
+def build_competitor_list():
+    competitors = [{
+        "name": analysis["name"],
+        "url": analysis["url"],
+        "analysis": analysis["analysis"],
+        "analyzed_at": analysis["analyzed_at"]
+    } for analysis in competitor_crawler.analyses()]
+    
     return jsonify({
-        "count": 0,
-        "competitors": []
+        "count": len(competitors),
+        "competitors": competitors
     })
 
 @app.route('/analyze-competitor', methods=['POST', 'OPTIONS'])
 def analyze_competitor():
-    """Analizar un competidor específico por su URL (mantenido para compatibilidad)"""
+    """Analizar un competidor específico a partir del contenido de su web"""
     # Manejo de solicitud OPTIONS para preflight CORS
     if request.method == 'OPTIONS':
         return '', 204
@@ -414,210 +4237,66 @@ def analyze_competitor():
         return jsonify({"error": "Se requiere una 'url' en el JSON"}), 400
     
     url = data.get('url')
+    if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+        return jsonify({"error": "La 'url' debe empezar por http:// o https://"}), 400
+    try:
+        check_public_url(url)
+    except UnsafeURLError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        analysis, site, cached = analyze_competitor_site(url, force=bool(data.get('force')))
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 502
     
     return jsonify({
-        "message": "Esta funcionalidad ha cambiado.",
+        "message": "Análisis reutilizado: el contenido no ha cambiado" if cached else "Análisis generado",
         "competitor": {
-            "name": "Nombre no disponible",
+            "name": analysis["name"],
             "url": url,
-            "analysis": "Por favor, use el chat para solicitar un análisis específico de este competidor, comparándolo con Antares Innovate."
-        }
+            "analysis": analysis["analysis"],
+            "analyzed_at": analysis["analyzed_at"]
+        },
+        "cached_analysis": cached,
+        "pages": [{
+            "url": page["url"],
+            "title": page.get("title"),
+            "changed": page["url"] in site["changed"],
+            "error": page.get("error")
+        } for page in site["pages"]]
     })
 
 @app.route('/custom-report', methods=['POST', 'OPTIONS'])
 def generate_custom_report():
-    """Generar un informe personalizado (mantenido para compatibilidad)"""
+    """Encolar un informe personalizado (focus_area, industry, region)"""
     # Manejo de solicitud OPTIONS para preflight CORS
     if request.method == 'OPTIONS':
         return '', 204
-        
-    report_id = str(uuid.uuid4())
+    
+    # El cuerpo es opcional: sin JSON o con un JSON que no es un objeto se usan los valores por defecto
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    params = {key: data.get(key) for key in ("focus_area", "industry", "region")}
+    if any(value is not None and not isinstance(value, str) for value in params.values()):
+        return jsonify({"error": "Los campos 'focus_area', 'industry' y 'region' deben ser texto"}), 400
+    record = report_engine.submit("custom", params)
     return jsonify({
-        "message": "Esta funcionalidad no está disponible en esta versión.",
-        "report_id": report_id,
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "content": "Por favor, use el chat para solicitar análisis específicos de competidores, tendencias de mercado o recomendaciones estratégicas."
-    })
+        "message": "Informe personalizado en cola de generación",
+        "report_id": record["id"],
+        "status": record["status"],
+        "date": record["date"],
+        "status_url": f"/report/{record['id']}"
+    }), 202
 
 @app.route('/web-interface')
 def web_interface():
     """Interfaz web simple para interactuar con Curiosity"""
-    return render_template('index.html')
-
-if __name__ == '_main_':
-    # Crear directorio de plantillas si no existe
-    os.makedirs('templates', exist_ok=True)
-    
-    # Crear una plantilla HTML simple si no existe
-    template_path = os.path.join('templates', 'index.html')
-    if not os.path.exists(template_path):
-        with open(template_path, 'w') as f:
-            f.write("""
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Curiosity - Análisis de Mercado</title>
-    <style>
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }
-        header {
-            background-color: #2c3e50;
-            color: white;
-            padding: 20px;
-            border-radius: 5px;
-            margin-bottom: 20px;
-            text-align: center;
-        }
-        h1 {
-            margin: 0;
-        }
-        .container {
-            display: flex;
-            flex-wrap: wrap;
-            gap: 20px;
-        }
-        .chat-container {
-            flex: 1;
-            min-width: 300px;
-            background: white;
-            border-radius: 5px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            padding: 20px;
-        }
-        .messages {
-            height: 400px;
-            overflow-y: auto;
-            margin-bottom: 20px;
-            padding: 10px;
-            border: 1px solid #ddd;
-            border-radius: 5px;
-        }
-        .user-message, .bot-message {
-            padding: 10px;
-            margin-bottom: 10px;
-            border-radius: 5px;
-            max-width: 80%;
-        }
-        .user-message {
-            background-color: #3498db;
-            color: white;
-            margin-left: auto;
-        }
-        .bot-message {
-            background-color: #ecf0f1;
-        }
-        input, button {
-            padding: 10px;
-            border: 1px solid #ddd;
-            border-radius: 5px;
-        }
-        input {
-            width: 70%;
-        }
-        button {
-            background-color: #2c3e50;
-            color: white;
-            cursor: pointer;
-            border: none;
-        }
-        button:hover {
-            background-color: #34495e;
-        }
-    </style>
-</head>
-<body>
-    <header>
-        <h1>Curiosity - Análisis Competitivo y de Mercado</h1>
-        <p>Powered by Antares Innovate - La Creatividad Mueve el Mundo; la Tecnología lo Acelera.</p>
-    </header>
-
-    <div class="container">
-        <div class="chat-container">
-            <h2>Chat con Curiosity</h2>
-            <div class="messages" id="messages"></div>
-            <div>
-                <input type="text" id="user-input" placeholder="Pregunta sobre competidores, mercado o recomendaciones estratégicas...">
-                <button id="send-btn">Enviar</button>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        // Variables para almacenar el ID de sesión
-        let sessionId = session_${Date.now()};
-
-        // Referencias a elementos del DOM
-        const messagesContainer = document.getElementById('messages');
-        const userInput = document.getElementById('user-input');
-        const sendButton = document.getElementById('send-btn');
-
-        // Función para enviar mensajes al chatbot
-        async function sendMessage() {
-            const message = userInput.value.trim();
-            if (!message) return;
-
-            // Mostrar mensaje del usuario
-            appendMessage(message, 'user');
-            userInput.value = '';
-
-            try {
-                // Enviar solicitud al servidor
-                const response = await fetch('/chat', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
-                        message,
-                        session_id: sessionId
-                    })
-                });
-
-                if (!response.ok) {
-                    throw new Error('Error en la comunicación con el servidor');
-                }
-
-                const data = await response.json();
-                
-                // Mostrar respuesta del chatbot
-                appendMessage(data.response, 'bot');
-            } catch (error) {
-                console.error('Error:', error);
-                appendMessage('Lo siento, ha ocurrido un error al procesar tu mensaje.', 'bot');
-            }
-        }
+    return http_cache.respond("web-interface", lambda: render_template('index.html'), ttl=float("inf"))
 
-        // Función para añadir mensajes al contenedor
-        function appendMessage(text, sender) {
-            const messageDiv = document.createElement('div');
-            messageDiv.className = sender === 'user' ? 'user-message' : 'bot-message';
-            messageDiv.textContent = text;
-            messagesContainer.appendChild(messageDiv);
-            messagesContainer.scrollTop = messagesContainer.scrollHeight;
-        }
-
-        // Eventos
-        sendButton.addEventListener('click', sendMessage);
-        userInput.addEventListener('keypress', (e) => {
-            if (e.key === 'Enter') sendMessage();
-        });
-
-        // Inicialización
-        appendMessage('Hola, soy Curiosity, especialista en análisis competitivo y de mercado para soluciones de IA conversacional. Puedo ayudarte a comparar competidores con Antares Innovate, analizar tendencias del mercado y proporcionar recomendaciones estratégicas. ¿Sobre qué competidor o tendencia te gustaría saber más?', 'bot');
-    </script>
-</body>
-</html>
-            """)
-    
+if __name__ == '__main__':
     # Obtener puerto de variables de entorno (para Render)
     port = int(os.environ.get("PORT", 5000))
     
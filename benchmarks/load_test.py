@@ -0,0 +1,357 @@
+"""Prueba de carga de Curiosity contra un Ollama simulado.
+
+Lanza peticiones concurrentes a /chat, /reset y /health, mide la latencia
+(p50/p95/p99), el rendimiento y la memoria del servicio, y guarda los resultados
+en benchmarks/results para comparar ejecuciones.
+
+Uso contra un servicio ya arrancado:
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --server-pid 1234
+
+Uso arrancando el Ollama simulado y gunicorn automáticamente:
+    python benchmarks/load_test.py --start --concurrency 50 --sessions 200 --duration 60
+
+Comparar con una ejecución anterior:
+    python benchmarks/load_test.py --start --compare benchmarks/results/20240101-120000-base.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+MESSAGES = [
+    "¿Cuáles son las fortalezas de Aivo frente a Antares Innovate?",
+    "Compara los precios de Botmaker con los de AVA",
+    "¿Qué tendencias de IA conversacional hay en Colombia?",
+    "Resume las debilidades de IBM Watson Assistant",
+    "¿Qué integraciones con CRM ofrecen los competidores?",
+    "Recomienda una estrategia de precios para pymes"
+]
+
+
+def percentile(values, fraction):
+    """Percentil por el método del rango más cercano"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def process_tree_rss(pid):
+    """Memoria residente (bytes) de un proceso y sus descendientes, leída de /proc"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class MemorySampler(threading.Thread):
+    """Muestrea periódicamente la memoria del servicio durante la prueba"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append(process_tree_rss(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.samples.append(process_tree_rss(self.pid))
+
+    def summary(self):
+        samples = [s for s in self.samples if s]
+        if not samples:
+            return None
+        return {
+            "start_mb": round(samples[0] / 2**20, 1),
+            "peak_mb": round(max(samples) / 2**20, 1),
+            "end_mb": round(samples[-1] / 2**20, 1)
+        }
+
+
+def parse_mix(mix):
+    """Convertir "chat:8,reset:1,health:1" en operaciones y pesos"""
+    operations, weights = [], []
+    for part in mix.split(","):
+        name, _, weight = part.partition(":")
+        if name.strip() not in ("chat", "reset", "health"):
+            raise ValueError(f"Operación desconocida en --mix: {name}")
+        operations.append(name.strip())
+        weights.append(float(weight or 1))
+    return operations, weights
+
+
+def run_operation(http, base_url, operation, session_id, timeout):
+    """Ejecutar una petición y devolver (código HTTP o nombre del error, correcta)"""
+    try:
+        if operation == "chat":
+            response = http.post(f"{base_url}/chat", json={
+                "message": random.choice(MESSAGES),
+                "session_id": session_id,
+                "no_cache": True
+            }, timeout=timeout)
+        elif operation == "reset":
+            response = http.post(f"{base_url}/reset", json={"session_id": session_id}, timeout=timeout)
+        else:
+            response = http.get(f"{base_url}/health", timeout=timeout)
+        response.content
+        return str(response.status_code), response.status_code < 400
+    except requests.exceptions.RequestException as e:
+        return type(e).__name__, False
+
+
+def run_load(args):
+    """Lanzar los clientes concurrentes y recoger una muestra por petición"""
+    operations, weights = parse_mix(args.mix)
+    results = []
+    results_lock = threading.Lock()
+    counter = iter(range(args.requests)) if args.requests else None
+    counter_lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(index):
+        http = requests.Session()
+        rng = random.Random(index)
+        local = []
+        while time.monotonic() < deadline:
+            if counter is not None:
+                with counter_lock:
+                    if next(counter, None) is None:
+                        break
+            operation = rng.choices(operations, weights)[0]
+            session_id = f"bench-{rng.randrange(args.sessions)}"
+            started = time.monotonic()
+            status, ok = run_operation(http, args.url, operation, session_id, args.timeout)
+            local.append((operation, time.monotonic() - started, status, ok))
+        with results_lock:
+            results.extend(local)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+
+def summarize(samples, elapsed):
+    """Latencias (ms), rendimiento y errores por operación y en total"""
+    def block(items):
+        latencies = [s[1] * 1000 for s in items if s[3]]
+        statuses = {}
+        for item in items:
+            statuses[item[2]] = statuses.get(item[2], 0) + 1
+        return {
+            "requests": len(items),
+            "errors": sum(1 for s in items if not s[3]),
+            "throughput_rps": round(len(items) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50), 1) if latencies else None,
+            "p95_ms": round(percentile(latencies, 0.95), 1) if latencies else None,
+            "p99_ms": round(percentile(latencies, 0.99), 1) if latencies else None,
+            "max_ms": round(max(latencies), 1) if latencies else None,
+            "statuses": statuses
+        }
+
+    summary = {"total": block(samples)}
+    for operation in sorted({s[0] for s in samples}):
+        summary[operation] = block([s for s in samples if s[0] == operation])
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_until_ready(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code < 500:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def start_services(args, workdir):
+    """Arrancar el Ollama simulado y Curiosity con gunicorn en puertos locales"""
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(BENCHMARKS_DIR, "mock_ollama.py"),
+        "--port", str(args.mock_port),
+        "--tokens-per-second", str(args.mock_tokens_per_second),
+        "--first-token-delay", str(args.mock_first_token_delay),
+        "--response-tokens", str(args.mock_response_tokens),
+        "--error-rate", str(args.mock_error_rate),
+        "--forbidden-rate", str(args.mock_forbidden_rate),
+        "--slow-rate", str(args.mock_slow_rate),
+        "--hang-rate", str(args.mock_hang_rate)
+    ], stdout=subprocess.DEVNULL)
+    if not wait_until_ready(f"{mock_url}/api/tags", 10):
+        mock.terminate()
+        raise RuntimeError("El Ollama simulado no arrancó")
+
+    port = args.url.rsplit(":", 1)[1].split("/")[0]
+    env = dict(
+        os.environ,
+        PORT=port,
+        OLLAMA_URL=mock_url,
+        OLLAMA_FALLBACK_URL=mock_url,
+        SCHEDULER_ENABLED="false",
+        SESSION_DB_PATH=os.path.join(workdir, "sessions.db"),
+        REPORTS_DIR=os.path.join(workdir, "reports"),
+        CRAWL_CACHE_DIR=os.path.join(workdir, "crawl_cache"),
+        RETRIEVAL_INDEX_PATH=os.path.join(workdir, "retrieval_index.json")
+    )
+    log = open(os.path.join(workdir, "app.log"), "w")
+    app = subprocess.Popen(
+        ["gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    if not wait_until_ready(f"{args.url}/health", 60):
+        app.terminate()
+        mock.terminate()
+        raise RuntimeError(f"Curiosity no arrancó, ver {log.name}")
+    return mock, app
+
+
+def print_summary(summary, memory, compare=None):
+    columns = ("requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    print(f"{'operación':<10}" + "".join(f"{c:>16}" for c in columns))
+    for operation, block in summary.items():
+        row = f"{operation:<10}"
+        for column in columns:
+            value = block[column]
+            cell = "-" if value is None else str(value)
+            previous = (compare or {}).get(operation, {}).get(column)
+            if previous and value is not None:
+                cell += f" ({(value - previous) / previous * 100:+.0f}%)"
+            row += f"{cell:>16}"
+        print(row)
+    if memory:
+        print(f"memoria: inicio {memory['start_mb']} MB, pico {memory['peak_mb']} MB, final {memory['end_mb']} MB")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de Curiosity")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="URL base del servicio")
+    parser.add_argument("--concurrency", type=int, default=20, help="Clientes simultáneos")
+    parser.add_argument("--sessions", type=int, default=100, help="Número de sesiones distintas")
+    parser.add_argument("--duration", type=float, default=30.0, help="Duración máxima de la prueba en segundos")
+    parser.add_argument("--requests", type=int, default=0, help="Número total de peticiones (0 = sin límite)")
+    parser.add_argument("--mix", default="chat:8,reset:1,health:1", help="Peso de cada operación")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Tiempo máximo por petición")
+    parser.add_argument("--server-pid", type=int, help="PID del servicio para medir su memoria")
+    parser.add_argument("--label", default="run", help="Etiqueta del fichero de resultados")
+    parser.add_argument("--output-dir", default=os.path.join(BENCHMARKS_DIR, "results"))
+    parser.add_argument("--compare", help="Fichero de resultados anterior con el que comparar")
+    parser.add_argument("--start", action="store_true", help="Arrancar el Ollama simulado y gunicorn")
+    parser.add_argument("--mock-port", type=int, default=11435)
+    parser.add_argument("--mock-tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--mock-first-token-delay", type=float, default=0.2)
+    parser.add_argument("--mock-response-tokens", type=int, default=60)
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-forbidden-rate", type=float, default=0.0)
+    parser.add_argument("--mock-slow-rate", type=float, default=0.0)
+    parser.add_argument("--mock-hang-rate", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.url = args.url.rstrip("/")
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="curiosity-bench-")
+    try:
+        if args.start:
+            processes = list(start_services(args, workdir))
+            args.server_pid = processes[1].pid
+
+        sampler = MemorySampler(args.server_pid) if args.server_pid else None
+        if sampler:
+            sampler.start()
+        print(f"Carga contra {args.url}: {args.concurrency} clientes, {args.sessions} sesiones, mezcla {args.mix}")
+        samples, elapsed = run_load(args)
+        if sampler:
+            sampler.stop()
+    finally:
+        for process in reversed(processes):
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    summary = summarize(samples, elapsed)
+    memory = sampler.summary() if sampler else None
+    compare = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare = json.load(f)["summary"]
+    print_summary(summary, memory, compare)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{args.label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "label": args.label,
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "git_revision": git_revision(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output_dir")},
+            "elapsed_seconds": round(elapsed, 2),
+            "summary": summary,
+            "memory": memory
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Servidor de Ollama simulado para medir Curiosity sin una máquina con GPU.
+
+Emula /api/chat, /api/generate y /api/tags, con velocidad de generación, retardo
+hasta el primer token, streaming e inyección de errores, 403 y respuestas lentas o
+colgadas configurables.
+
+Uso:
+    python benchmarks/mock_ollama.py --port 11435 --tokens-per-second 40 --first-token-delay 0.3
+"""
+import argparse
+import json
+import random
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = (
+    "Antares Innovate puede diferenciarse con integraciones nativas, análisis de "
+    "conversaciones en español y precios por uso para pymes en Colombia y Estados Unidos "
+).split()
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None  # argparse.Namespace asignado al arrancar
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data):
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": name} for name in self.config.models]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        config = self.config
+        # Fallos inyectados, en el orden en que se evalúan
+        roll = random.random()
+        if roll < config.hang_rate:
+            time.sleep(config.hang_seconds)
+            self.close_connection = True
+            return
+        roll -= config.hang_rate
+        if roll < config.error_rate:
+            self._send_json(500, {"error": "simulated failure"})
+            return
+        roll -= config.error_rate
+        if roll < config.forbidden_rate:
+            self._send_json(403, {"error": "simulated forbidden"})
+            return
+        roll -= config.forbidden_rate
+        delay = config.slow_delay if roll < config.slow_rate else 0.0
+
+        chat = self.path == "/api/chat"
+        model = data.get("model", config.models[0])
+        tokens = [WORDS[i % len(WORDS)] + " " for i in range(config.response_tokens)]
+        prompt = json.dumps(data.get("messages") or data.get("prompt") or "")
+        token_interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        started = time.monotonic()
+
+        time.sleep(delay + config.first_token_delay)
+
+        def final_fields():
+            eval_duration = int(len(tokens) * token_interval * 1e9) or 1
+            return {
+                "model": model,
+                "done": True,
+                "prompt_eval_count": max(1, len(prompt) // 4),
+                "prompt_eval_duration": int(config.first_token_delay * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": eval_duration,
+                "load_duration": int(config.load_duration * 1e9),
+                "total_duration": int((time.monotonic() - started) * 1e9)
+            }
+
+        if data.get("stream", True):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for token in tokens:
+                    chunk = {"model": model, "done": False}
+                    if chat:
+                        chunk["message"] = {"role": "assistant", "content": token}
+                    else:
+                        chunk["response"] = token
+                    self._send_chunk(chunk)
+                    time.sleep(token_interval)
+                final = final_fields()
+                if chat:
+                    final["message"] = {"role": "assistant", "content": ""}
+                else:
+                    final["response"] = ""
+                self._send_chunk(final)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+            return
+
+        time.sleep(token_interval * len(tokens))
+        response = final_fields()
+        text = "".join(tokens).strip()
+        if chat:
+            response["message"] = {"role": "assistant", "content": text}
+        else:
+            response["response"] = text
+        self._send_json(200, response)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor de Ollama simulado para pruebas de carga")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", default="neural-chat:7b", help="Modelos anunciados en /api/tags, separados por comas")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="Velocidad de generación (0 = instantánea)")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="Segundos hasta el primer token")
+    parser.add_argument("--response-tokens", type=int, default=60, help="Tokens por respuesta")
+    parser.add_argument("--load-duration", type=float, default=0.0, help="load_duration informado en segundos")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones que responden 500")
+    parser.add_argument("--forbidden-rate", type=float, default=0.0, help="Fracción de peticiones que responden 403")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fracción de peticiones con retardo adicional")
+    parser.add_argument("--slow-delay", type=float, default=5.0, help="Retardo adicional de las peticiones lentas")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fracción de peticiones que no responden")
+    parser.add_argument("--hang-seconds", type=float, default=600.0, help="Tiempo que se mantiene colgada una petición")
+    args = parser.parse_args(argv)
+    args.models = [name.strip() for name in args.models.split(",") if name.strip()]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    MockOllamaHandler.config = args
+    server = ThreadingHTTPServer((args.host, args.port), MockOllamaHandler)
+    server.daemon_threads = True
+    print(f"Ollama simulado escuchando en http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
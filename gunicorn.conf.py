@@ -0,0 +1,29 @@
+# Configuración de gunicorn para Curiosity
+#
+# Por defecto se usan workers cooperativos de gevent: cada petición en curso es una
+# greenlet en lugar de un hilo o proceso, así que una llamada bloqueada a Ollama no
+# ocupa un worker entero y un solo proceso puede mantener cientos de chats abiertos.
+# gunicorn aplica el monkey-patching de gevent antes de importar app.py, por lo que
+# requests, los locks y los hilos de fondo pasan a ser no bloqueantes sin cambiar
+# ninguna ruta.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# gevent (cooperativo) o gthread / sync para volver al modelo clásico
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+
+# Conexiones simultáneas por worker en modo gevent
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# Hilos por worker en modo gthread
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# Las generaciones largas no deben provocar que el master reinicie el worker
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 300))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# La aplicación debe importarse dentro de cada worker, después del monkey-patching
+preload_app = False